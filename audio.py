@@ -1,47 +1,213 @@
-import pyaudio
 import numpy as np
 import sys
 import time
+import threading
+
+try:
+	import pyaudio
+except ImportError: # rendering without audio output (render.py) works without PyAudio
+	pyaudio = None
 
 _pA = None
-_streams = []
+_mixer = None
+channels = 2 # the output stream is always stereo
 		
 def initAudio():
 	global _pA
+	if pyaudio is None:
+		raise OSError("PyAudio is required for audio output.")
 	_pA = pyaudio.PyAudio()
 	
-def getCallback(sound):
-	buffer = (sound*32767).astype(np.int16).tobytes()[:]
-	cursor = 0
-	def streamCallback(input, frameCount, timeInfo, statusFlags):
-		nonlocal cursor
-		nonlocal buffer
+def playbackBuffer(signal):
+	# float32 (channels, frames) copy of a signal, the layout the mixer plays without any conversion
+	signal = np.asarray(signal, dtype=np.float32)
+	if signal.ndim == 1:
+		return signal[np.newaxis]
+	return np.ascontiguousarray(signal[:channels])
+	
+def _stereo(signal):
+	# (channels, frames) view of a signal, mono signals are played on both channels
+	signal = np.asarray(signal, dtype=np.float32)
+	if signal.ndim == 1:
+		signal = signal[np.newaxis]
+	return np.broadcast_to(signal[:channels], (channels, signal.shape[-1]))
 	
-		bytesCount = 2*frameCount 
-		playBuf = buffer[cursor:]
-		cursor += bytesCount
+class RingBuffer:
+	# Single producer, single consumer ring buffer of (channels, frames) samples. It needs no lock: the
+	# producer only ever advances writeCount and the consumer only ever advances readCount.
+	def __init__(self, capacity, channels=channels, dtype=np.float32):
+		self.capacity = capacity
+		self.buffer = np.zeros((channels, capacity), dtype=dtype)
+		self.writeCount = 0
+		self.readCount = 0
+		
+	def available(self):
+		return self.writeCount - self.readCount
+		
+	def free(self):
+		return self.capacity - self.available()
+		
+	def write(self, samples):
+		count = min(samples.shape[-1], self.free())
+		start = self.writeCount % self.capacity
+		first = min(count, self.capacity - start)
+		self.buffer[:, start:start+first] = samples[:, :first]
+		self.buffer[:, :count-first] = samples[:, first:count]
+		self.writeCount += count
+		return count
+		
+	def read(self, count):
+		count = min(count, self.available())
+		start = self.readCount % self.capacity
+		first = min(count, self.capacity - start)
+		data = np.concatenate((self.buffer[:, start:start+first], self.buffer[:, :count-first]), axis=1)
+		self.readCount += count
+		return data
+		
+class BufferVoice:
+	# plays a completely rendered buffer
+	def __init__(self, buffer):
+		self.buffer = _stereo(buffer)
+		self.cursor = 0
+		self.stopped = False
+		
+	def read(self, frameCount):
+		data = self.buffer[:, self.cursor:self.cursor+frameCount]
+		self.cursor += frameCount
+		return data
+		
+	def isFinished(self):
+		return self.stopped or self.cursor >= self.buffer.shape[1]
+		
+	def stop(self):
+		self.stopped = True
+		
+class LivePlayback:
+	# Renders blocks on a separate thread into a ring buffer, which is drained by the mixer.
+	# Underruns (the mixer needed samples which were not rendered yet) are counted to size buffers.
+	def __init__(self, blocks, sampleRate, bufferSize):
+		self.sampleRate = sampleRate
+		self.ringBuffer = RingBuffer(bufferSize)
+		self.underruns = 0
+		self.underrunFrames = 0
+		self.finished = False
+		self.stopped = False
+		self.error = None
+		self._firstBlock = threading.Event()
+		self._thread = threading.Thread(target=self._render, args=(iter(blocks),), daemon=True)
 		
-		if len(playBuf) < bytesCount:
-			data = playBuf + b"\x00"*(bytesCount - len(playBuf))
-			task = pyaudio.paComplete
+	def _render(self, blocks):
+		try:
+			for block in blocks:
+				samples = _stereo(np.clip(block, -1.0, 1.0))
+				while samples.shape[1] and not self.stopped:
+					written = self.ringBuffer.write(samples)
+					samples = samples[:, written:]
+					self._firstBlock.set()
+					if samples.shape[1]:
+						time.sleep(0.25 * self.ringBuffer.capacity / self.sampleRate)
+				if self.stopped:
+					break
+		except Exception as e:
+			self.error = e
+		finally:
+			self.finished = True
+			self._firstBlock.set()
+			
+	def start(self):
+		self._thread.start()
+		self._firstBlock.wait() # time to first sound is the time of rendering one block
+		if self.error:
+			raise self.error
+			
+	def stop(self):
+		self.stopped = True
+		
+	def read(self, frameCount):
+		finished = self.finished # read before draining, so no samples written in between are lost
+		data = self.ringBuffer.read(frameCount)
+		missing = frameCount - data.shape[1]
+		if missing > 0 and not finished and not self.stopped:
+			self.underruns += 1
+			self.underrunFrames += missing
+			data = np.concatenate((data, np.zeros((channels, missing), dtype=data.dtype)), axis=1)
+		return data
+		
+	def isFinished(self):
+		return self.stopped or (self.finished and not self.ringBuffer.available())
+		
+class Mixer:
+	# Mixes a fixed number of voices into one persistent output stream. If all voices are busy,
+	# the oldest one is stolen.
+	def __init__(self, sampleRate, voiceCount=16):
+		self.sampleRate = sampleRate
+		self.voices = [None] * voiceCount
+		self.gains = np.zeros(voiceCount, dtype=np.float32)
+		self._started = [0] * voiceCount
+		self._voiceCounter = 0
+		self.stream = None
+		
+	def start(self):
+		self.stream = _pA.open(channels=channels, rate=self.sampleRate, output=True, format=pyaudio.paInt16, stream_callback=self.streamCallback)
+		self.stream.start_stream()
+		
+	def close(self):
+		self.stream.stop_stream()
+		self.stream.close()
+		
+	def addVoice(self, voice, gain=1.0):
+		free = [i for i, v in enumerate(self.voices) if v is None or v.isFinished()]
+		if free:
+			index = free[0]
 		else:
-			data = playBuf[:bytesCount]
-			task = pyaudio.paContinue
-
-		assert(len(data) == bytesCount)
-		return (data, task)
+			index = min(range(len(self.voices)), key=lambda i: self._started[i])
+			self.voices[index].stop()
+		self._voiceCounter += 1
+		self._started[index] = self._voiceCounter
+		self.gains[index] = gain
+		self.voices[index] = voice
+		return index
+		
+	def stopAll(self):
+		for voice in self.voices:
+			if voice:
+				voice.stop()
+		
+	def streamCallback(self, input, frameCount, timeInfo, statusFlags):
+		voices = list(self.voices) # voices may be replaced by the gui thread meanwhile
+		gains = self.gains.copy()
 		
-	return streamCallback
+		frames = np.zeros((len(voices), channels, frameCount), dtype=np.float32)
+		for i, voice in enumerate(voices):
+			if voice is None or voice.isFinished():
+				gains[i] = 0.0
+			else:
+				data = voice.read(frameCount)
+				frames[i, :, :data.shape[1]] = data
+		mixed = np.clip(np.tensordot(gains, frames, axes=1), -1.0, 1.0)
+		
+		return ((mixed.T*32767).astype(np.int16).tobytes(), pyaudio.paContinue) # interleaved frames
+	
+def getMixer(sampleRate):
+	global _mixer
+	if _mixer is None or _mixer.sampleRate != sampleRate:
+		if _mixer:
+			_mixer.close()
+		_mixer = Mixer(sampleRate)
+		_mixer.start()
+	return _mixer
 	
-def play(buffer, sampleRate):
-	stream = _pA.open(channels=1, rate=sampleRate, output=True, format=pyaudio.paInt16, stream_callback=getCallback(buffer))
-	stream.start_stream()
+def play(buffer, sampleRate, gain=1.0):
+	voice = BufferVoice(buffer)
+	getMixer(sampleRate).addVoice(voice, gain)
+	return voice
 	
-	_streams.append(stream)
+def playLive(blocks, sampleRate, bufferSize=16384, gain=1.0):
+	playback = LivePlayback(blocks, sampleRate, bufferSize)
+	playback.start()
+	getMixer(sampleRate).addVoice(playback, gain)
+	return playback
 	
-	for stream in _streams:
-		if not stream.is_active():
-			stream.stop_stream()
-			stream.close()
-			_streams.remove(stream)
-			del stream
+def stop():
+	if _mixer:
+		_mixer.stopAll()
@@ -0,0 +1,297 @@
+import sys
+import os, os.path
+import time
+import json
+import inspect
+import platform
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from decorators import getRegisteredFunctions, ParameterType
+from synth import Synthesizer, SynthParameters, NodeState, OutputBuffer, Output
+from graphmodel import FlowGraph, loadGraph
+import export
+import nodes # registers the node functions
+import effects
+
+# Benchmarks of the node functions and of whole graph renders, e.g.
+#   python benchmark.py -o before.json
+#   python benchmark.py -o after.json --compare before.json
+# Times are the best of several repetitions, the peak memory is measured with tracemalloc in an extra run.
+
+_version = 1 # of the JSON format
+
+def _setProperty(node, name, value):
+	node.properties[name] = node.properties[name]._replace(value=value)
+
+def _testSignal(params):
+	# a low sine as input for every stream knob
+	return (0.5 * np.sin(2 * np.pi * 110.0 * params.time())).astype(params.dtype)
+
+def functionArguments(func, params, streams, waveFile):
+	# Arguments of a direct call. Stream knobs get the test signal (frequencies around 440 Hz) if streams is True,
+	# else the defaults of unconnected knobs. Properties keep their defaults.
+	signal = _testSignal(params)
+	arguments = {}
+	for parameter in inspect.signature(func).parameters.values():
+		annotation = parameter.annotation
+		if annotation == SynthParameters:
+			arguments[parameter.name] = params
+		elif annotation == NodeState:
+			arguments[parameter.name] = NodeState()
+		elif annotation == OutputBuffer:
+			arguments[parameter.name] = np.empty(params.samples, params.dtype)
+		elif isinstance(annotation, ParameterType) and annotation.hasKnob and (streams or not annotation.hasEditable):
+			arguments[parameter.name] = 440.0 + 10.0 * signal if annotation.isFrequency else signal
+		else:
+			arguments[parameter.name] = parameter.default
+	if func is nodes.fromWaveFile:
+		arguments["filename"] = waveFile
+	return arguments
+
+def _functionCall(func, arguments):
+	# the arguments are built once and only the function is timed, every call starts with an empty node state
+	states = [name for name, value in arguments.items() if isinstance(value, NodeState)]
+	def call():
+		for name in states:
+			arguments[name] = NodeState()
+		return func(**arguments)
+	return call
+
+def _measure(call, repeats):
+	# best and mean wall time of repeats calls after one warm up call (caches, wavetables), peak traced memory of one more call
+	call()
+	times = []
+	for i in range(repeats):
+		start = time.perf_counter()
+		call()
+		times.append(time.perf_counter() - start)
+	tracemalloc.start()
+	call()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return min(times), sum(times) / len(times), peak
+
+def benchmarkFunctions(sampleRates, lengths, repeats, waveFile, selected=None):
+	results = []
+	for func in getRegisteredFunctions():
+		if func is Output or (selected and func.__name__ not in selected):
+			continue
+		for streams in (False, True):
+			for sampleRate in sampleRates:
+				for length in lengths:
+					params = SynthParameters(sampleRate, length)
+					entry = {"function": func.__name__, "inputs": "streams" if streams else "properties", "sampleRate": sampleRate, "length": length}
+					try:
+						best, mean, peak = _measure(_functionCall(func, functionArguments(func, params, streams, waveFile)), repeats)
+					except Exception as e:
+						entry["error"] = "%s: %s" % (type(e).__name__, e)
+					else:
+						entry.update(seconds=best, meanSeconds=mean, samplesPerSecond=params.totalSamples / best, peakBytes=peak)
+					results.append(entry)
+	return results
+
+# reference graphs, built with the graph model so they do not depend on the editor
+
+def wideGraph(width=64):
+	# many independent oscillators summed by a tree of add nodes
+	graph = FlowGraph()
+	output = graph.addNode(Output)
+	oscillators = (nodes.sin, nodes.sawtooth, nodes.rectangle, nodes.triangleSawtooth)
+	layer = []
+	for i in range(width):
+		node = graph.addNode(oscillators[i % len(oscillators)])
+		_setProperty(node, "frequency", 110.0 * (1 + i))
+		_setProperty(node, "amplitude", 1.0 / width)
+		layer.append(node)
+	while len(layer) > 1:
+		summed = []
+		for a, b in zip(layer[0::2], layer[1::2]):
+			node = graph.addNode(nodes.add)
+			graph.connect(a, node, "signalA")
+			graph.connect(b, node, "signalB")
+			summed.append(node)
+		layer = summed + layer[len(summed)*2:]
+	graph.connect(layer[0], output, "input")
+	return graph
+
+def deepGraph(depth=32):
+	# one long chain of filters and clippers behind a sawtooth
+	graph = FlowGraph()
+	output = graph.addNode(Output)
+	previous = graph.addNode(nodes.sawtooth)
+	for i in range(depth):
+		node = graph.addNode(effects.biquadFilter if i % 2 == 0 else nodes.clamp)
+		if i % 2 == 0:
+			_setProperty(node, "cutoff", 8000.0 - 100.0 * i)
+			graph.connect(previous, node, "signal")
+		else:
+			graph.connect(previous, node, "channel")
+		previous = node
+	graph.connect(previous, output, "input")
+	return graph
+
+def diamondGraph(layers=16):
+	# every layer splits the signal into two branches and joins them again, results are shared by two consumers
+	graph = FlowGraph()
+	output = graph.addNode(Output)
+	previous = graph.addNode(nodes.whistle)
+	for i in range(layers):
+		delay = graph.addNode(nodes.delay)
+		_setProperty(delay, "delayTime", 0.001 * (i + 1))
+		graph.connect(previous, delay, "signal")
+		clamp = graph.addNode(nodes.clamp)
+		_setProperty(clamp, "level", 0.8)
+		graph.connect(previous, clamp, "channel")
+		mix = graph.addNode(nodes.mix)
+		graph.connect(delay, mix, "channelA")
+		graph.connect(clamp, mix, "channelB")
+		previous = mix
+	graph.connect(previous, output, "input")
+	return graph
+
+def waveGraph(waveFile, voices=8):
+	# stereo samples, panned, mixed and sent through a reverb
+	graph = FlowGraph()
+	output = graph.addNode(Output)
+	mixed = None
+	for i in range(voices):
+		sample = graph.addNode(nodes.fromWaveFile)
+		_setProperty(sample, "filename", waveFile)
+		_setProperty(sample, "amplitude", 1.0 / voices)
+		pan = graph.addNode(nodes.pan)
+		_setProperty(pan, "position", -1.0 + 2.0 * i / max(voices - 1, 1))
+		graph.connect(sample, pan, "signal")
+		if mixed is None:
+			mixed = pan
+		else:
+			node = graph.addNode(nodes.add)
+			graph.connect(mixed, node, "signalA")
+			graph.connect(pan, node, "signalB")
+			mixed = node
+	reverb = graph.addNode(effects.reverb)
+	graph.connect(mixed, reverb, "signal")
+	graph.connect(reverb, output, "input")
+	return graph
+
+def writeCorpus(directory, sampleRate, length):
+	# writes the reference graphs and the wave file they use, returns the graph file names
+	os.makedirs(directory, exist_ok=True)
+	waveFile = os.path.abspath(os.path.join(directory, "benchmark.wav"))
+	times = np.arange(int(2.0 * sampleRate)) / sampleRate
+	export.writeWave(waveFile, 0.5 * np.stack((np.sin(2 * np.pi * 220.0 * times), np.sin(2 * np.pi * 330.0 * times))), sampleRate)
+	fileNames = []
+	for name, graph in (("wide", wideGraph()), ("deep", deepGraph()), ("diamond", diamondGraph()), ("wave", waveGraph(waveFile))):
+		output = graph.nodes[0]
+		_setProperty(output, "sampleRate", sampleRate)
+		_setProperty(output, "length", length)
+		fileName = os.path.join(directory, name + ".mfg")
+		graph.save(fileName)
+		fileNames.append(fileName)
+	return waveFile, fileNames
+
+def benchmarkGraphs(fileNames, repeats, threads=1, blockSize=1024):
+	# whole renders (synthesizeFromFlowGraph) and block-wise renders as for live playback, without render cache
+	results = []
+	# the synthesizers (and their thread pools) are created once, every timed call compiles the graph again
+	synthesizer = Synthesizer(cacheBytes=0, threads=threads)
+	blockSynthesizer = Synthesizer(cacheBytes=0)
+	def render():
+		synthesizer.invalidate()
+		synthesizer.synthesizeFromFlowGraph(graph)
+	def renderBlocks():
+		blockSynthesizer.invalidate()
+		for block in blockSynthesizer.synthesizeBlocks(graph, blockSize):
+			pass
+	try:
+		for fileName in fileNames:
+			graph = loadGraph(fileName)
+			parameters = synthesizer.compile(graph).synthParameters
+			audioSeconds = parameters.totalSamples / parameters.sampleRate
+			for mode, call in (("render", render), ("blocks", renderBlocks)):
+				entry = {"graph": os.path.splitext(os.path.basename(fileName))[0], "mode": mode, "nodes": len(graph.nodes), "threads": threads if mode == "render" else 1, "audioSeconds": audioSeconds}
+				try:
+					best, mean, peak = _measure(call, repeats)
+				except Exception as e:
+					entry["error"] = "%s: %s" % (type(e).__name__, e)
+				else:
+					# real-time factor: processing time per second of audio, below 1.0 is faster than real time
+					entry.update(seconds=best, meanSeconds=mean, realTimeFactor=best / audioSeconds, peakBytes=peak)
+				results.append(entry)
+	finally:
+		if synthesizer.executor:
+			synthesizer.executor.shutdown()
+	return results
+
+def _key(entry):
+	if "function" in entry:
+		return ("function", entry["function"], entry["inputs"], entry["sampleRate"], entry["length"])
+	return ("graph", entry["graph"], entry["mode"], entry["threads"])
+
+def compare(results, baseline, threshold):
+	# prints the change of every timed entry against the baseline run, returns the number of regressions
+	previous = {_key(entry): entry for entry in baseline["functions"] + baseline["graphs"] if "seconds" in entry}
+	regressions = 0
+	for entry in results["functions"] + results["graphs"]:
+		old = previous.get(_key(entry))
+		if old is None or "seconds" not in entry:
+			continue
+		ratio = entry["seconds"] / old["seconds"]
+		regressed = ratio > 1.0 + threshold
+		regressions += regressed
+		if regressed or ratio < 1.0 - threshold:
+			print("%-60s %9.3f ms -> %9.3f ms  %5.2fx%s" % (" ".join(str(value) for value in _key(entry)[1:]), old["seconds"] * 1e3, entry["seconds"] * 1e3, ratio, "  slower" if regressed else ""))
+	print("%d regressions (more than %.0f%% slower)" % (regressions, threshold * 100))
+	return regressions
+
+def main(arguments):
+	parser = argparse.ArgumentParser(description="Benchmark the node functions and reference graphs of Möhre.")
+	parser.add_argument("graphs", nargs="*", help="additional flow graph files (*.mfg) to render")
+	parser.add_argument("-o", "--output", default="benchmark.json", help="JSON file of the results (default: %(default)s)")
+	parser.add_argument("-r", "--repeats", type=int, default=5, help="timed repetitions, the best one counts (default: %(default)s)")
+	parser.add_argument("--rates", type=int, nargs="+", default=[22050, 44100, 96000], help="sample rates of the function benchmarks (default: %(default)s)")
+	parser.add_argument("--lengths", type=float, nargs="+", default=[0.1, 1.0, 5.0], help="lengths in seconds of the function benchmarks (default: %(default)s)")
+	parser.add_argument("--functions", nargs="+", help="only benchmark these node functions")
+	parser.add_argument("--corpus", help="directory of the reference graphs (default: a temporary directory)")
+	parser.add_argument("--graph-length", type=float, default=10.0, help="length in seconds of the reference graphs (default: %(default)s)")
+	parser.add_argument("-t", "--threads", type=int, default=1, help="threads evaluating independent nodes in whole renders (default: %(default)s)")
+	parser.add_argument("--no-functions", action="store_true", help="skip the function benchmarks")
+	parser.add_argument("--no-graphs", action="store_true", help="skip the graph benchmarks")
+	parser.add_argument("-c", "--compare", help="results of an earlier run to compare with")
+	parser.add_argument("--threshold", type=float, default=0.1, help="relative slow down reported as regression (default: %(default)s)")
+	args = parser.parse_args(arguments)
+
+	with tempfile.TemporaryDirectory() as temporary:
+		waveFile, corpus = writeCorpus(args.corpus or temporary, 44100, args.graph_length)
+		results = {"version": _version, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "numpy": np.__version__, "machine": platform.platform(), "processor": platform.processor(), "functions": [], "graphs": []}
+		if not args.no_functions:
+			results["functions"] = benchmarkFunctions(args.rates, args.lengths, args.repeats, waveFile, args.functions)
+			for entry in results["functions"]:
+				if "error" in entry:
+					print("%-20s %-10s %6d Hz %5.1f s  %s" % (entry["function"], entry["inputs"], entry["sampleRate"], entry["length"], entry["error"]))
+				else:
+					print("%-20s %-10s %6d Hz %5.1f s  %9.3f ms  %7.1f MSamples/s  %8.1f MB peak" % (entry["function"], entry["inputs"], entry["sampleRate"], entry["length"], entry["seconds"] * 1e3, entry["samplesPerSecond"] / 1e6, entry["peakBytes"] / 1e6))
+		if not args.no_graphs:
+			results["graphs"] = benchmarkGraphs(corpus + args.graphs, args.repeats, args.threads)
+			for entry in results["graphs"]:
+				if "error" in entry:
+					print("%-20s %-6s %s" % (entry["graph"], entry["mode"], entry["error"]))
+				else:
+					print("%-20s %-6s %4d nodes  %9.3f ms  real-time factor %.4f  %8.1f MB peak" % (entry["graph"], entry["mode"], entry["nodes"], entry["seconds"] * 1e3, entry["realTimeFactor"], entry["peakBytes"] / 1e6))
+
+	with open(args.output, "w") as file:
+		json.dump(results, file, indent=4)
+	if args.compare:
+		with open(args.compare) as file:
+			baseline = json.load(file)
+		if baseline.get("version") != _version:
+			print("%s has format version %s, expected %d." % (args.compare, baseline.get("version"), _version), file=sys.stderr)
+			return 2
+		return 1 if compare(results, baseline, args.threshold) else 0
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -4,9 +4,10 @@ _funcs = []
 _outputFunctions = []
 
 class ParameterType:
-	def __init__(self, type, hasEditable=False, hasKnob=False):
+	def __init__(self, type, hasEditable=False, hasKnob=False, isFrequency=False):
 		self.hasEditable = hasEditable
 		self.hasKnob = hasKnob
+		self.isFrequency = isFrequency # scaled by the note's pitch when rendering several notes at once
 		self.type = type
 		
 	def __call__(self, *args, **kwargs):
@@ -15,6 +16,7 @@ class ParameterType:
 def StreamOnly(type): return ParameterType(type, hasEditable=False, hasKnob=True)		
 def StreamOrProperty(type): return ParameterType(type, hasEditable=True, hasKnob=True)		
 def PropertyOnly(type): return ParameterType(type, hasEditable=True, hasKnob=False)
+def Frequency(type): return ParameterType(type, hasEditable=True, hasKnob=True, isFrequency=True)
 
 
 def registerFunction(func):
@@ -29,6 +31,30 @@ def registerFunction(func):
 			raise ValueError("Non data parameters must have default values.")
 	return func
 
+def pureFunction(factors=()):
+	# Marks node functions whose result only depends on their arguments (no time, state or randomness), nodes
+	# with only constant inputs are evaluated once when the graph is compiled. The result of the function is
+	# the product of the arguments named in factors, so factors of 1 can be dropped and a factor of 0 makes it 0.
+	def decorator(func):
+		func.isPure = True
+		func.factors = tuple(factors)
+		return func
+	return decorator
+
+def randomFunction(func):
+	# Marks node functions returning a different result for the same arguments (noise), the render cache keeps
+	# a separate result for every node of such a function.
+	func.isRandom = True
+	return func
+
+def readsFiles(*parameters):
+	# Marks node functions reading the files named by the given properties, the render plan is compiled again
+	# when one of the files is modified.
+	def decorator(func):
+		func.fileParameters = parameters
+		return func
+	return decorator
+
 def registerOutputFunction(func):
 	# Implemented as a output function list, even though just a single output function is allowed, because
 	# in case it is decided to support multiple outputs, the implementation of this feature only requires
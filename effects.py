@@ -0,0 +1,195 @@
+import os
+import functools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import scipy.fft
+import scipy.signal
+
+from decorators import *
+from synth import SynthParameters, NodeState, SynthException
+import samplecache
+
+# Effects with memory. Convolutions (reverb, FIR filters) use uniformly partitioned overlap-add in the
+# frequency domain, so long impulse responses cost one FFT pair per partition plus a multiply-add per impulse
+# response partition. IIR filters are cascades of biquad sections. Both keep their state in the node state
+# and produce the same result for whole buffers and for any block size.
+
+filterTypes = ("lowpass", "highpass", "bandpass")
+
+minPartitionSize = 64
+maxPartitionSize = 8192
+
+def partitionSize(samples):
+	# partitions as long as the blocks, so every block needs one FFT pair
+	return int(np.clip(2**int(np.ceil(np.log2(max(samples, 1)))), minPartitionSize, maxPartitionSize))
+
+class SpectrumCache:
+	# Spectra of impulse response partitions, shared by all nodes and renders with the same impulse response.
+	# Entries are evicted least recently used first when they exceed maxBytes.
+	def __init__(self, maxBytes):
+		self.maxBytes = maxBytes
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, impulseResponse, partitionSize, dtype):
+		# impulseResponse: function returning the (channels, samples) or (samples,) impulse response
+		key = key + (partitionSize, np.dtype(dtype).str)
+		with self._lock:
+			spectra = self._entries.get(key)
+			if spectra is not None:
+				self._entries.move_to_end(key)
+				return spectra
+
+		spectra = self._partition(np.asarray(impulseResponse(), dtype=np.float64), partitionSize, dtype)
+		with self._lock:
+			self._entries[key] = spectra
+			while len(self._entries) > 1 and sum(entry.nbytes for entry in self._entries.values()) > self.maxBytes:
+				self._entries.popitem(last=False)
+		return spectra
+
+	@staticmethod
+	def _partition(impulseResponse, partitionSize, dtype):
+		# (partitions, channels..., partitionSize+1) spectra of the zero padded partitions
+		length = max(impulseResponse.shape[-1], 1)
+		partitions = -(-length // partitionSize)
+		padded = np.zeros(impulseResponse.shape[:-1] + (partitions * partitionSize,))
+		padded[..., :impulseResponse.shape[-1]] = impulseResponse
+		padded = np.moveaxis(padded.reshape(impulseResponse.shape[:-1] + (partitions, partitionSize)), -2, 0)
+		spectra = scipy.fft.rfft(padded, n=2*partitionSize, axis=-1).astype(np.result_type(dtype, np.complex64))
+		spectra.flags.writeable = False
+		return spectra
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+_spectra = SpectrumCache(128*1024*1024)
+
+class Convolver:
+	# Convolves a stream with the impulse response given by its partition spectra, without latency. The spectra
+	# of the last input partitions form a delay line, their products with the impulse response partitions are
+	# summed once per partition. The current, partially filled partition is transformed again on every call.
+	def __init__(self, spectra, partitionSize, dtype):
+		self.spectra = spectra
+		self.partitionSize = partitionSize
+		self.dtype = dtype
+		self.history = None # input partition spectra, newest first
+		self.input = None # samples of the current partition
+		self.fill = 0
+		self.overlap = None # second half of the previous partition's output
+		self.base = None # spectrum of the older partitions' contribution to the current partition
+
+	def _start(self, shape):
+		size = self.partitionSize
+		self.history = np.zeros((len(self.spectra),) + shape + (size + 1,), self.spectra.dtype)
+		self.input = np.zeros(shape + (size,), self.dtype)
+		self.overlap = np.zeros(shape + (size,), self.dtype)
+		self.base = np.zeros(shape + (size + 1,), self.spectra.dtype)
+
+	def process(self, signal):
+		size = self.partitionSize
+		samples = signal.shape[-1]
+		if self.history is None:
+			self._start(np.broadcast_shapes(signal.shape[:-1], self.spectra.shape[1:-1]))
+		output = np.empty(self.input.shape[:-1] + (samples,), self.dtype)
+		done = 0
+		while done < samples:
+			count = min(samples - done, size - self.fill)
+			self.input[..., self.fill:self.fill+count] = signal[..., done:done+count]
+			self.history[0] = scipy.fft.rfft(self.input, n=2*size, axis=-1)
+			result = scipy.fft.irfft(self.base + self.history[0] * self.spectra[0], n=2*size, axis=-1)
+			output[..., done:done+count] = result[..., self.fill:self.fill+count] + self.overlap[..., self.fill:self.fill+count]
+			self.fill += count
+			done += count
+
+			if self.fill == size: # partition complete, it moves into the delay line
+				self.overlap[...] = result[..., size:]
+				self.history[1:] = self.history[:-1]
+				if len(self.spectra) > 1:
+					self.base = np.einsum("k...f,k...f->...f", self.history[1:], self.spectra[1:])
+				self.input[...] = 0.0
+				self.fill = 0
+		return output
+
+def _syntheticImpulse(decayTime, sampleRate):
+	# decorrelated exponentially decaying noise on two channels, -60 dB after decayTime, with unit energy.
+	# The noise is seeded, so renders are reproducible.
+	length = max(1, int(decayTime * sampleRate))
+	envelope = np.exp(np.log(1e-3) * np.arange(length) / length)
+	impulse = np.random.default_rng(0).standard_normal((2, length)) * envelope
+	return impulse / np.sqrt(np.sum(impulse**2, axis=-1, keepdims=True))
+
+def _firImpulse(filterType, cutoff, bandwidth, taps, sampleRate):
+	nyquist = sampleRate / 2.0
+	if filterType == "bandpass":
+		edges = [np.clip(cutoff - bandwidth/2, 1.0, nyquist - 2.0), np.clip(cutoff + bandwidth/2, 2.0, nyquist - 1.0)]
+		return scipy.signal.firwin(taps, edges, pass_zero=False, fs=sampleRate)
+	return scipy.signal.firwin(taps | 1, np.clip(cutoff, 1.0, nyquist - 1.0), pass_zero=(filterType == "lowpass"), fs=sampleRate)
+
+@functools.lru_cache(maxsize=64)
+def biquadSections(filterType, cutoff, q, sampleRate, stages):
+	# second order sections after the audio EQ cookbook (R. Bristow-Johnson), stages identical sections in series
+	w = 2 * np.pi * np.clip(cutoff, 1.0, 0.499 * sampleRate) / sampleRate
+	alpha = np.sin(w) / (2 * max(q, 1e-3))
+	cos = np.cos(w)
+	if filterType == "lowpass":
+		b = [(1 - cos) / 2, 1 - cos, (1 - cos) / 2]
+	elif filterType == "highpass":
+		b = [(1 + cos) / 2, -(1 + cos), (1 + cos) / 2]
+	else: # band pass with 0 dB gain at the center frequency
+		b = [alpha, 0.0, -alpha]
+	a = [1 + alpha, -2 * cos, 1 - alpha]
+	sections = np.tile(np.array(b + a) / a[0], (max(stages, 1), 1))
+	sections.flags.writeable = False
+	return sections
+
+def _checkFilterType(filterType):
+	if filterType not in filterTypes:
+		raise SynthException("Unknown filter type '%s', use one of %s." % (filterType, ", ".join(filterTypes)))
+
+def _stream(signal, params):
+	# constant inputs are expanded to the block
+	return np.broadcast_to(np.asarray(signal, params.dtype), np.shape(signal)[:-1] + (params.samples,))
+
+@registerFunction
+@readsFiles("impulseResponse")
+def reverb(params:SynthParameters=None, state:NodeState=None, signal:StreamOnly(np.ndarray)=0.0, impulseResponse:PropertyOnly(str)="", decayTime:PropertyOnly(float)=1.5, wet:StreamOrProperty(float)=0.3):
+	# convolution with the impulse response wave file, or with a synthetic stereo room of decayTime seconds
+	if "convolver" not in state:
+		size = partitionSize(params.samples)
+		if impulseResponse:
+			try:
+				path = os.path.abspath(impulseResponse)
+				sample = samplecache.getSample(path, params.sampleRate)
+				spectra = _spectra.get(("file", path, os.path.getmtime(path), params.sampleRate), lambda: sample.read(0, sample.frames), size, params.dtype)
+			except (OSError, samplecache.SampleException) as e:
+				raise SynthException("Impulse response: %s" % e)
+		else:
+			spectra = _spectra.get(("reverb", decayTime, params.sampleRate), lambda: _syntheticImpulse(decayTime, params.sampleRate), size, params.dtype)
+		state["convolver"] = Convolver(spectra, size, params.dtype)
+	signal = _stream(signal, params)
+	return signal*(1-wet) + state["convolver"].process(signal)*wet
+
+@registerFunction
+def firFilter(params:SynthParameters=None, state:NodeState=None, signal:StreamOnly(np.ndarray)=0.0, filterType:PropertyOnly(str)="lowpass", cutoff:PropertyOnly(float)=1000.0, bandwidth:PropertyOnly(float)=500.0, taps:PropertyOnly(int)=255):
+	# linear phase windowed sinc filter, bandwidth is only used by band pass filters
+	if "convolver" not in state:
+		_checkFilterType(filterType)
+		size = partitionSize(params.samples)
+		spectra = _spectra.get(("fir", filterType, cutoff, bandwidth, taps, params.sampleRate), lambda: _firImpulse(filterType, cutoff, bandwidth, taps, params.sampleRate), size, params.dtype)
+		state["convolver"] = Convolver(spectra, size, params.dtype)
+	return state["convolver"].process(_stream(signal, params))
+
+@registerFunction
+def biquadFilter(params:SynthParameters=None, state:NodeState=None, signal:StreamOnly(np.ndarray)=0.0, filterType:PropertyOnly(str)="lowpass", cutoff:PropertyOnly(float)=1000.0, q:PropertyOnly(float)=0.707, stages:PropertyOnly(int)=1):
+	# resonant filter, every further stage adds 12 dB per octave
+	_checkFilterType(filterType)
+	sections = biquadSections(filterType, cutoff, q, params.sampleRate, stages)
+	signal = _stream(signal, params)
+	if "zi" not in state:
+		state["zi"] = np.zeros((len(sections),) + signal.shape[:-1] + (2,))
+	# sosfilt only accepts writable sections, the cached ones are read only
+	result, state["zi"] = scipy.signal.sosfilt(np.array(sections), signal, axis=-1, zi=state["zi"])
+	return result.astype(params.dtype, copy=False)
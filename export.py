@@ -0,0 +1,94 @@
+import struct
+
+import numpy as np
+
+# Streaming wave file writer. Blocks are converted and written as they are rendered, so exporting needs
+# memory for one block only. The RIFF sizes are patched when the file is closed.
+
+formatInt16 = "int16"
+formatInt24 = "int24"
+formatFloat32 = "float32"
+formats = (formatInt16, formatInt24, formatFloat32)
+
+_formatPCM = 1
+_formatFloat = 3
+_chunkSize = 65536 # samples per channel converted at once by writeWave
+
+class ExportException(Exception):
+	pass
+
+class WaveWriter:
+	def __init__(self, filename, sampleRate, format=formatInt16, dither=False):
+		if format not in formats:
+			raise ExportException("Unknown sample format '%s', use one of %s." % (format, ", ".join(formats)))
+		self.sampleRate = sampleRate
+		self.format = format
+		self.dither = dither and format != formatFloat32 # float has no quantization step to dither
+		self.sampleWidth = {formatInt16: 2, formatInt24: 3, formatFloat32: 4}[format]
+		self.channels = None # known with the first block
+		self.frames = 0
+		self._random = np.random.default_rng()
+		self._file = open(filename, "wb")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+
+	def _writeHeader(self):
+		formatTag = _formatFloat if self.format == formatFloat32 else _formatPCM
+		blockAlign = self.channels * self.sampleWidth
+		dataSize = self.frames * blockAlign
+		self._file.write(struct.pack("<4sI4s", b"RIFF", 36 + dataSize + dataSize % 2, b"WAVE"))
+		self._file.write(struct.pack("<4sIHHIIHH", b"fmt ", 16, formatTag, self.channels, self.sampleRate, self.sampleRate * blockAlign, blockAlign, self.sampleWidth * 8))
+		self._file.write(struct.pack("<4sI", b"data", dataSize))
+
+	def _quantize(self, block, scale, dtype):
+		# scaled to the integer range, triangular (TPDF) dither of +-1 step decorrelates the quantization distortion
+		scaled = np.multiply(block, scale, dtype=np.float64)
+		if self.dither:
+			scaled += self._random.random(scaled.shape)
+			scaled -= self._random.random(scaled.shape)
+		np.rint(scaled, out=scaled)
+		np.clip(scaled, -scale - 1, scale, out=scaled)
+		return scaled.astype(dtype)
+
+	def write(self, block):
+		# block: samples of one channel or (channels, samples)
+		block = np.asarray(block)
+		channels = 1 if block.ndim == 1 else block.shape[0]
+		if self.channels is None:
+			self.channels = channels
+			self._writeHeader()
+		elif channels != self.channels:
+			raise ExportException("Block with %d channels written to a file with %d channels." % (channels, self.channels))
+		frames = block.T # interleaved when serialized in C order
+
+		if self.format == formatInt16:
+			data = self._quantize(frames, 32767.0, "<i2").tobytes()
+		elif self.format == formatInt24:
+			# the three low bytes of little endian 32 bit integers
+			data = self._quantize(frames, 8388607.0, "<i4").reshape(-1, 1).view(np.uint8)[:, :3].tobytes()
+		else:
+			data = frames.astype("<f4").tobytes()
+		self._file.write(data)
+		self.frames += len(frames)
+
+	def close(self):
+		if self._file.closed:
+			return
+		if self.channels is None: # nothing written
+			self.channels = 1
+			self._writeHeader()
+		if self.frames * self.channels * self.sampleWidth % 2:
+			self._file.write(b"\0") # chunks are word aligned, the pad byte is not part of the data size
+		self._file.seek(0)
+		self._writeHeader()
+		self._file.close()
+
+def writeWave(filename, buffer, sampleRate, format=formatInt16, dither=False):
+	# writes a rendered buffer, converting only _chunkSize samples at once
+	with WaveWriter(filename, sampleRate, format, dither) as writer:
+		for start in range(0, max(np.shape(buffer)[-1], 1), _chunkSize):
+			writer.write(buffer[..., start:start+_chunkSize])
@@ -1,26 +1,98 @@
-from collections import namedtuple, OrderedDict
+from collections import OrderedDict
 import math
-import inspect
 import functools
-import json
 
+import numpy as np
 from PyQt5 import QtOpenGL, QtGui, QtCore, QtWidgets, Qt
 from OpenGL.GL import *
 from OpenGL.GLU import *
+from OpenGL.arrays import vbo
 from synth import *
-from propertyeditor import camelCaseToWords, Property
+from graphmodel import FlowGraph, Connection, GraphException
+from propertyeditor import camelCaseToWords
 	
-def glCircle(x,y, radius, segments=10):
-	glBegin(GL_TRIANGLE_FAN)
-	glVertex2f(x,y)
-	t = 0.0
-	for i in range(segments+1):
-		glVertex2f(x+math.sin(t)*radius, y+math.cos(t)*radius)
-		t += math.pi/segments
-	glEnd()
+# The geometry of nodes and connections is tessellated with NumPy into vertex buffers. All connections are drawn
+# with one glDrawArrays call, every node with two. Only nodes which moved or changed and the connections at their
+# knobs are tessellated again.
+
+def rgba(c):
+	return (c.redF(), c.greenF(), c.blueF(), c.alphaF())
 	
 def qglColor(c):
-	glColor4f(c.redF(), c.greenF(), c.blueF(), c.alphaF())
+	glColor4f(*rgba(c))
+	
+def rectTriangles(x1, y1, x2, y2):
+	return np.array([(x1, y1), (x2, y1), (x2, y2), (x1, y1), (x2, y2), (x1, y2)], dtype=np.float32)
+	
+def halfCircleTriangles(centers, radii, segments=10):
+	# triangles of half circles around centers (n, 2) from the top to the bottom, on the left side for negative radii
+	t = np.linspace(0.0, math.pi, segments+1)
+	centers = np.asarray(centers, dtype=np.float32).reshape(-1, 1, 2)
+	arc = centers + np.stack((np.sin(t), np.cos(t)), axis=-1) * np.asarray(radii, dtype=np.float32).reshape(-1, 1, 1)
+	triangles = np.empty((len(centers), segments, 3, 2), dtype=np.float32)
+	triangles[:, :, 0] = centers
+	triangles[:, :, 1] = arc[:, :-1]
+	triangles[:, :, 2] = arc[:, 1:]
+	return triangles.reshape(-1, 2)
+	
+def bezierCurves(starts, ends, segments=20):
+	# (n, segments+1, 2) points of the connection curves from starts (n, 2) to ends, leaving and entering horizontally
+	starts = np.asarray(starts, dtype=np.float64).reshape(-1, 1, 2)
+	ends = np.asarray(ends, dtype=np.float64).reshape(-1, 1, 2)
+	velocity = 0.5 * np.linalg.norm(ends - starts, axis=-1, keepdims=True) * np.array([1.0, 0.0])
+	t = np.linspace(0.0, 1.0, segments+1).reshape(-1, 1)
+	u = 1 - t
+	return (u*u*u*starts + 3*u*u*t*(starts - velocity) + 3*u*t*t*(ends + velocity) + t*t*t*ends).astype(np.float32)
+	
+def lineSegments(curves):
+	# the line strips (n, points, 2) as separate segments for GL_LINES, so all of them are drawn at once
+	return np.stack((curves[:, :-1], curves[:, 1:]), axis=2).reshape(-1, 2)
+	
+def colorVertices(points, colors):
+	# rows (x, y, r, g, b, a) of the node vertex buffer, colors: one QColor or (n, 4) values
+	vertices = np.empty((len(points), 6), dtype=np.float32)
+	vertices[:, :2] = points
+	vertices[:, 2:] = colors if isinstance(colors, np.ndarray) else rgba(colors)
+	return vertices
+	
+class SpatialGrid:
+	# Uniform grid over the bounding boxes of items, so hit tests only look at the items of one cell instead
+	# of all of them. Items are registered in every cell their box overlaps.
+	def __init__(self, cellSize=64):
+		self.cellSize = cellSize
+		self._cells = {} # (column, row) => set of items
+		self._itemCells = {} # item => cells it is registered in
+		
+	def _cellsOf(self, box):
+		x1, y1, x2, y2 = box
+		columns = range(math.floor(x1 / self.cellSize), math.floor(x2 / self.cellSize) + 1)
+		rows = range(math.floor(y1 / self.cellSize), math.floor(y2 / self.cellSize) + 1)
+		return [(column, row) for column in columns for row in rows]
+		
+	def insert(self, item, box):
+		# also moves an item which is in the grid already
+		cells = self._cellsOf(box)
+		if self._itemCells.get(item) == cells:
+			return
+		self.remove(item)
+		for cell in cells:
+			self._cells.setdefault(cell, set()).add(item)
+		self._itemCells[item] = cells
+		
+	def remove(self, item):
+		for cell in self._itemCells.pop(item, ()):
+			items = self._cells[cell]
+			items.discard(item)
+			if not items:
+				del self._cells[cell]
+				
+	def query(self, x, y):
+		# items whose box may contain the point
+		return self._cells.get((math.floor(x / self.cellSize), math.floor(y / self.cellSize)), ())
+		
+	def clear(self):
+		self._cells.clear()
+		self._itemCells.clear()
 
 	
 class Draggable:
@@ -43,38 +115,15 @@ class Draggable:
 class FlowNode(QtCore.QObject, Draggable):
 	nodeFont = None # initialized on first construction
 
-	def __init__(self, func, parent=None):
+	def __init__(self, model, parent=None):
 		QtCore.QObject.__init__(self, parent)
 		
-		self.x = 20
-		self.y = 20
+		self.model = model # graphmodel.Node, holds position, function and properties
 		self.h = 70
 		self.w = self.h*1.618 #goldener schnitt!
-		self.func = func
 		
-		self.knobs = []
-		
-		if not self.isOutput():
-			self.knobs.append(FlowKnob(self, FlowKnob.knobTypeOutput, "Output"))
-		
-		self.properties = OrderedDict()
-		
-		self.title = camelCaseToWords(func.__name__)
-		signature = inspect.signature(func)
-		for parameter in signature.parameters.values():
-			property = Property(name=parameter.name, type=parameter.annotation, value=parameter.default)
-			
-			if property.type == SynthParameters:
-				property = property._replace(hasKnob=False, hasEditable=False)
-			else:
-				property = property._replace(hasKnob=property.type.hasKnob, hasEditable=property.type.hasEditable)
-				
-			if property.hasKnob:
-				knob = FlowKnob(self, FlowKnob.knobTypeInput, property.name, self.getInputKnobCount())
-				self.knobs.append(knob)
-				property = property._replace(knob=knob)
-			
-			self.properties[parameter.name] = property
+		self.knobs = [FlowKnob(self, knob) for knob in model.knobs]
+		self.title = camelCaseToWords(model.func.__name__)
 				
 		# cannot be intialized statically, because a QApplication must be started
 		if not FlowNode.nodeFont:
@@ -85,39 +134,96 @@ class FlowNode(QtCore.QObject, Draggable):
 		self.fontHeight = fontMetrics.height()
 		self.fontAscent = fontMetrics.ascent()
 		self.h = self.fontLineHeight * (self.getInputKnobCount()+1)
+		
+		self._geometry = None # vertices and number of triangle vertices, see geometry()
+		self._geometryKey = None
 				
-	def getInputKnobCount(self):
-		return len(list(filter(lambda x : x.type == FlowKnob.knobTypeInput, self.knobs)))
-
-	def draw(self, selected=False):
-		textOffset = 3
-		shadowOffset = (1,1)
+	@property
+	def x(self):
+		return self.model.x
 		
-		qglColor(self.parent().nodeShadowColor)
-		glRectf(self.x+shadowOffset[0], self.y+shadowOffset[1], self.x+self.w+shadowOffset[0], self.y+self.h+shadowOffset[1])
+	@x.setter
+	def x(self, value):
+		self.model.x = value
 		
-		qglColor(self.parent().nodeBorderColor if not selected else self.parent().nodeBorderColorSelected)
-		glRectf(self.x, self.y, self.x+self.w, self.y+self.h)
+	@property
+	def y(self):
+		return self.model.y
 		
-		qglColor(self.parent().nodeBackgroundColor if not selected else self.parent().nodeBackgroundColorSelected)
-		glRectf(self.x+1, self.y+1, self.x+self.w-1, self.y+self.h-1)
+	@y.setter
+	def y(self, value):
+		self.model.y = value
 		
+	@property
+	def func(self):
+		return self.model.func
+		
+	@property
+	def properties(self):
+		return self.model.properties
+		
+	def getInputKnobCount(self):
+		return len(list(filter(lambda x : x.type == FlowKnob.knobTypeInput, self.knobs)))
+
+	def geometry(self, selected=False):
+		# the vertices are only tessellated again if the node moved, got (de)selected or a knob got (dis)connected
+		key = (self.x, self.y, selected, tuple(knob.isConnected() for knob in self.knobs))
+		if key != self._geometryKey:
+			self._geometry = self.tessellate(selected)
+			self._geometryKey = key
+		return self._geometry
+		
+	def tessellate(self, selected=False):
+		# vertices (x, y, r, g, b, a) of the triangles (shadow, border, background, knobs) followed by the title line
+		editor = self.parent()
+		shadowOffset = (1,1)
+		borderColor = editor.nodeBorderColor if not selected else editor.nodeBorderColorSelected
+		
+		knobColors = np.array([rgba(editor.connectionColor if knob.isConnected() else editor.knobColor) for knob in self.knobs], dtype=np.float32).reshape(-1, 4)
+		knobs = halfCircleTriangles([knob.getPosition() for knob in self.knobs], [knob.radius if knob.type == FlowKnob.knobTypeOutput else -knob.radius for knob in self.knobs]) # negative radius to flip half circle
+		triangles = np.concatenate((
+			colorVertices(rectTriangles(self.x+shadowOffset[0], self.y+shadowOffset[1], self.x+self.w+shadowOffset[0], self.y+self.h+shadowOffset[1]), editor.nodeShadowColor),
+			colorVertices(rectTriangles(self.x, self.y, self.x+self.w, self.y+self.h), borderColor),
+			colorVertices(rectTriangles(self.x+1, self.y+1, self.x+self.w-1, self.y+self.h-1), editor.nodeBackgroundColor if not selected else editor.nodeBackgroundColorSelected),
+			colorVertices(knobs, np.repeat(knobColors, len(knobs) // max(len(self.knobs), 1), axis=0)),
+		))
+		line = colorVertices([(self.x + 3, self.y + self.fontLineHeight), (self.x + self.w - 3, self.y + self.fontLineHeight)], borderColor)
+		return np.concatenate((triangles, line)), len(triangles)
+		
+	def drawText(self, selected=False):
+		textOffset = 3
 		for knob in self.knobs:
-			knob.draw(textOffset=textOffset)
+			knob.drawText()
 			
-		qglColor(self.parent().nodeBorderColor if not selected else self.parent().nodeBorderColorSelected)
-		glBegin(GL_LINES)
-		glVertex2f(self.x + 3, self.y + self.fontLineHeight)
-		glVertex2f(self.x + self.w - 3, self.y + self.fontLineHeight)
-		glEnd()
-		
 		qglColor(self.parent().nodeTextColor if not selected else self.parent().nodeTextColorSelected)
 		self.nodeFont.setBold(True)
 		self.parent().renderText(self.x+textOffset, self.y+(self.fontLineHeight+self.fontAscent)*0.5, self.title, font=self.nodeFont) # works only if parent is qglWidget ;)
 		self.nodeFont.setBold(False)
 		
+		profile = self.parent().profile.get(self.model)
+		if profile:
+			self.drawProfile(profile)
+			
+	def drawProfile(self, profile):
+		# below the node: a bar of its share of the total render time, the time and the output memory
+		editor = self.parent()
+		share = profile.seconds / editor.profileSeconds if editor.profileSeconds else 0.0
+		qglColor(editor.profileColor)
+		glRectf(self.x, self.y+self.h+3, self.x+max(self.w*share, 1), self.y+self.h+6)
+		
+		qglColor(editor.nodeTextColor)
+		lines = ["%.1f ms (%.0f%%)" % (profile.seconds*1e3, share*100), "%d calls, %.1f MB" % (profile.calls, profile.bytes/1e6)]
+		if profile.cacheHits:
+			lines.append("%d cache hits" % profile.cacheHits)
+		for i, line in enumerate(lines):
+			editor.renderText(self.x, self.y+self.h+6+self.fontAscent+i*self.fontHeight, line, font=self.nodeFont)
+		
+	def boundingBox(self):
+		return self.x, self.y, self.x+self.w, self.y+self.h
+		
 	def isInShape(self, x,y):
-		return self.x <= x <= self.x+self.w and self.y <= y <= self.y+self.h
+		x1, y1, x2, y2 = self.boundingBox()
+		return x1 <= x <= x2 and y1 <= y <= y2
 		
 	def startDrag(self, dragObject):
 		dragObject.custom = (dragObject.startX - self.x, dragObject.startY - self.y)
@@ -125,6 +231,7 @@ class FlowNode(QtCore.QObject, Draggable):
 	def updateDrag(self, dragObject):
 		self.x = dragObject.x - dragObject.custom[0]
 		self.y = dragObject.y - dragObject.custom[1]
+		self.parent().updateIndex(self)
 		
 	def __str__(self):
 		return "FlowNode '%s'" % self.title
@@ -135,13 +242,13 @@ class FlowNode(QtCore.QObject, Draggable):
 	def isOutput(self):
 		return self.func in self.parent().outputFunctions
 		
-class FlowConnectionError(Exception):
+class FlowConnectionError(GraphException):
 	pass
 	
 class FlowConnection(QtCore.QObject):
 	width = 2
 		
-	def __init__(self, knobA, knobB, parent=None):
+	def __init__(self, knobA, knobB, parent=None, model=None):
 		QtCore.QObject.__init__(self, parent)
 		if knobA.type == FlowKnob.knobTypeInput and knobB.type == FlowKnob.knobTypeOutput:
 			self.inputKnob = knobA
@@ -151,33 +258,29 @@ class FlowConnection(QtCore.QObject):
 			self.outputKnob = knobA
 		else:
 			raise FlowConnectionError("Invalid connection.")
-		
-	def draw(self):
-		x1, y1 = self.inputKnob.getPosition()
-		x2, y2 = self.outputKnob.getPosition()
-		self.drawLine(self.parent().connectionColor, x1, y1, x2, y2)
+		self.model = model if model else Connection(self.inputKnob.model, self.outputKnob.model)
+		self._geometry = None # GL_LINES vertices of the curve
+		self._geometryKey = None
+		
+	def geometry(self):
+		# only tessellated again if one of the knobs moved
+		key = (self.inputKnob.getPosition(), self.outputKnob.getPosition())
+		if key != self._geometryKey:
+			self._geometry = lineSegments(bezierCurves(*key))
+			self._geometryKey = key
+		return self._geometry
 		
 	@staticmethod
 	def drawLine(color, startX, startY, endX, endY):
+		# a single curve from client memory, used while dragging a new connection
 		qglColor(color)
 		glLineWidth(FlowConnection.width)
-
-		# Bezier Curve
-		velocity = 0.5 * math.sqrt((endX-startX)*(endX-startX) + (endY-startY)*(endY-startY))
-		segments = 20
-		glBegin(GL_LINE_STRIP)
-		for segment in range(segments+1):
-			t = segment / segments
-			u = 1-t
-			tt = t*t
-			uu = u*u
-			uuu = uu*u
-			ttt = tt*t
-			# 
-			x = uuu*startX + 3*uu*t*(startX-velocity) + 3*u*tt*(endX+velocity) + ttt*endX
-			y = uuu*startY + 3*uu*t*(startY) + 3*u*tt*(endY) + ttt*endY
-			glVertex2f(x, y)
-		glEnd()
+		points = bezierCurves((startX, startY), (endX, endY))[0]
+		glBindBuffer(GL_ARRAY_BUFFER, 0)
+		glEnableClientState(GL_VERTEX_ARRAY)
+		glVertexPointer(2, GL_FLOAT, 0, points)
+		glDrawArrays(GL_LINE_STRIP, 0, len(points))
+		glDisableClientState(GL_VERTEX_ARRAY)
 		
 	def __str__(self):
 		return "FlowConnection from '%s' to '%s'" % (self.outputKnob, self.inputKnob)
@@ -191,22 +294,16 @@ class FlowKnob(QtCore.QObject, Draggable):
 	
 	radius = 10
 	
-	def __init__(self, node, type, name, index=-1):
+	def __init__(self, node, model):
 		self.node = node
-		self.type = type
-		self.index = index
-		self.name = name
-		
-	def draw(self, textOffset=0):
-		x,y = self.getPosition()
-		if not self.isConnected():
-			qglColor(self.node.parent().knobColor)
-		else:
-			qglColor(self.node.parent().connectionColor)
-		if self.type == self.knobTypeOutput:
-			glCircle(x,y, self.radius)
+		self.model = model # graphmodel.Knob
+		self.type = model.type
+		self.index = model.index
+		self.name = model.name
+		
+	def drawText(self):
 		if self.type == self.knobTypeInput:
-			glCircle(x,y, -self.radius) # negative radius to flip half circle
+			x,y = self.getPosition()
 			qglColor(self.node.parent().nodeTextColor)
 			self.node.parent().renderText(x+3, y+self.node.fontAscent*0.5, self.name, font=self.node.nodeFont) 
 		
@@ -218,15 +315,19 @@ class FlowKnob(QtCore.QObject, Draggable):
 		elif self.type == self.knobTypeOutput:
 			return self.node.x + self.node.w, self.node.y + self.node.h/2
 		
-	def isInShape(self, x,y):
+	def boundingBox(self):
 		kx, ky = self.getPosition()
 		if self.type == self.knobTypeInput:
-			return kx-self.radius <= x <= kx and ky-self.radius <= y <= ky+self.radius
+			return kx-self.radius, ky-self.radius, kx, ky+self.radius
 		elif self.type == self.knobTypeOutput:
-			return kx <= x <= kx+self.radius and ky-self.radius <= y <= ky+self.radius
+			return kx, ky-self.radius, kx+self.radius, ky+self.radius
+			
+	def isInShape(self, x,y):
+		x1, y1, x2, y2 = self.boundingBox()
+		return x1 <= x <= x2 and y1 <= y <= y2
 			
 	def isConnected(self):
-		return next(self.node.parent().findConnections(self), None) is not None
+		return self.model.isConnected()
 			
 	def drawDrag(self, dragObject):
 		# swap them if necessary, so the bezier curves won't look off (have the right control points)
@@ -251,6 +352,7 @@ class FlowKnob(QtCore.QObject, Draggable):
 
 class GLFlowEditor(QtOpenGL.QGLWidget):
 	signalEditNode = QtCore.pyqtSignal(OrderedDict)
+	signalGraphChanged = QtCore.pyqtSignal()
 	
 	dragModeDraggingEmpty = 0
 	dragModeDraggingNode = 1
@@ -288,11 +390,23 @@ class GLFlowEditor(QtOpenGL.QGLWidget):
 			
 		self.functions = functions
 		self.outputFunctions = outputFunctions
+		self.graph = FlowGraph(functions, outputFunctions) # what the synthesizer renders
 		self.nodes = []
 		self.connections = []
+		self._connectionItems = {} # graphmodel.Connection => FlowConnection
 		
 		self.dragObject = None
 		self.selectedNode = None
+		self._nodeIndex = SpatialGrid() # bounding boxes for pickNode and pickKnob
+		self._knobIndex = SpatialGrid()
+		self.profile = {} # graphmodel.Node => profiler.NodeProfile shown below the node
+		self.profileSeconds = 0.0
+		
+		self._nodeBuffer = None # vertex buffer of all nodes, created by the first paint
+		self._nodeRanges = {} # FlowNode => (first vertex in the buffer, vertices)
+		self._connectionBuffer = None
+		self._connectionRanges = {} # FlowConnection => (first vertex in the buffer, vertices)
+		QtWidgets.QApplication.instance().aboutToQuit.connect(self.deleteBuffers)
 		
 		self.addNode(Output, 600, 300) # outputDummy should be a static function in the synthesizer
 		
@@ -308,6 +422,7 @@ class GLFlowEditor(QtOpenGL.QGLWidget):
 		self.nodeTextColorSelected = palette.color(QtGui.QPalette.Text)
 		self.knobColor = palette.color(QtGui.QPalette.Button)
 		self.connectionColor = palette.color(QtGui.QPalette.Dark)
+		self.profileColor = palette.color(QtGui.QPalette.Highlight)
 
 		mode = "nohighcontrast"
 		if mode == "highcontrast":
@@ -321,6 +436,7 @@ class GLFlowEditor(QtOpenGL.QGLWidget):
 			self.nodeTextColorSelected = QtGui.QColor(QtCore.Qt.white)
 			self.knobColor = QtGui.QColor(QtCore.Qt.darkRed)
 			self.connectionColor = QtGui.QColor(QtCore.Qt.yellow)
+			self.profileColor = QtGui.QColor(QtCore.Qt.red)
 		
 	def initializeGL(self):
 		self.qglClearColor(self.backgroundColor)
@@ -333,46 +449,129 @@ class GLFlowEditor(QtOpenGL.QGLWidget):
 		gluOrtho2D(0,w,h,0)
 		glViewport(0,0,w,h)
 		
+	def deleteBuffers(self):
+		# while the GL context still exists, they would be deleted during interpreter shutdown else
+		self.makeCurrent()
+		for buffer in (self._nodeBuffer, self._connectionBuffer):
+			if buffer is not None:
+				buffer.delete()
+		self._nodeBuffer = None
+		self._connectionBuffer = None
+		self._nodeRanges.clear()
+		self._connectionRanges.clear()
+		
+	@staticmethod
+	def _updateBuffer(buffer, ranges, geometries, columns):
+		# geometries: item => vertices. Changed vertices are copied into their range of the buffer, it is only
+		# rebuilt if items were added or removed or their number of vertices changed.
+		if buffer is not None and ranges.keys() == geometries.keys() and all(len(ranges[item][1]) == len(vertices) for item, vertices in geometries.items()):
+			for item, vertices in geometries.items():
+				first, previous = ranges[item]
+				if vertices is not previous:
+					buffer[first:first+len(vertices)] = vertices
+					ranges[item] = (first, vertices)
+			return buffer
+			
+		ranges.clear()
+		first = 0
+		for item, vertices in geometries.items():
+			ranges[item] = (first, vertices)
+			first += len(vertices)
+		data = np.concatenate(list(geometries.values())) if geometries else np.zeros((0, columns), dtype=np.float32)
+		if buffer is None:
+			return vbo.VBO(data)
+		buffer.set_array(data)
+		return buffer
+		
 	def paintGL(self):
 		glClear(GL_COLOR_BUFFER_BIT)
 		
+		# Text is drawn over the nodes by Qt, so every node is drawn with its text before the next one to keep
+		# the z-order. Qt's text rendering changes the GL state, the arrays are set up again for every node.
+		geometries = {node: node.geometry(node is self.selectedNode) for node in self.nodes}
+		self._nodeBuffer = self._updateBuffer(self._nodeBuffer, self._nodeRanges, {node: vertices for node, (vertices, triangles) in geometries.items()}, 6)
 		for node in reversed(self.nodes):
-			node.draw(selected=(node is self.selectedNode))
-		
-		for connection in self.connections:
-			connection.draw()
+			first, vertices = self._nodeRanges[node]
+			triangles = geometries[node][1]
+			self._nodeBuffer.bind()
+			glEnableClientState(GL_VERTEX_ARRAY)
+			glEnableClientState(GL_COLOR_ARRAY)
+			glVertexPointer(2, GL_FLOAT, 24, self._nodeBuffer)
+			glColorPointer(4, GL_FLOAT, 24, self._nodeBuffer + 8)
+			glDrawArrays(GL_TRIANGLES, first, triangles)
+			glDrawArrays(GL_LINES, first + triangles, len(vertices) - triangles)
+			glDisableClientState(GL_COLOR_ARRAY)
+			glDisableClientState(GL_VERTEX_ARRAY)
+			self._nodeBuffer.unbind()
+			node.drawText(selected=(node is self.selectedNode))
+		
+		# all connections at once
+		self._connectionBuffer = self._updateBuffer(self._connectionBuffer, self._connectionRanges, {connection: connection.geometry() for connection in self.connections}, 2)
+		if self.connections:
+			qglColor(self.connectionColor)
+			glLineWidth(FlowConnection.width)
+			self._connectionBuffer.bind()
+			glEnableClientState(GL_VERTEX_ARRAY)
+			glVertexPointer(2, GL_FLOAT, 0, self._connectionBuffer)
+			glDrawArrays(GL_LINES, 0, len(self._connectionBuffer.data))
+			glDisableClientState(GL_VERTEX_ARRAY)
+			self._connectionBuffer.unbind()
 			
 		if self.dragObject:
 			self.dragObject.draw()
 			
+	def setProfile(self, report):
+		# report: profiler.RenderProfiler.report(), empty to hide the overlay
+		self.profile = {profile.node: profile for profile in report}
+		self.profileSeconds = sum(profile.seconds for profile in report)
+		self.update()
+		
 	def addNode(self, func, x,y):
-		node = FlowNode(func, self)
-		node.x = x
-		node.y = y
+		node = FlowNode(self.graph.addNode(func, x, y), self)
 		self.nodes.append(node)
+		self.updateIndex(node)
+		self.signalGraphChanged.emit()
 		self.selectNode(node)
 		
 	def addConnection(self, connection):
-		for c in self.findConnections(connection.inputKnob):
-			if c.inputKnob == connection.inputKnob:
-				raise FlowConnectionError("Knob already connected.")
+		if connection.inputKnob.isConnected():
+			raise FlowConnectionError("Knob already connected.")
+		self.graph.addConnection(connection.model)
 		self.connections.append(connection)
-		
+		self._connectionItems[connection.model] = connection
+		self.signalGraphChanged.emit()
+		
+	def removeConnection(self, connection):
+		self.graph.removeConnection(connection.model)
+		self.connections.remove(connection)
+		del self._connectionItems[connection.model]
+		
+	def updateIndex(self, node):
+		# called whenever a node was added or moved
+		self._nodeIndex.insert(node, node.boundingBox())
+		for knob in node.knobs:
+			self._knobIndex.insert(knob, knob.boundingBox())
+			
+	def removeFromIndex(self, node):
+		self._nodeIndex.remove(node)
+		for knob in node.knobs:
+			self._knobIndex.remove(knob)
+			
 	def pickKnob(self, x, y):
-		for node in self.nodes:
-			for knob in node.knobs:
-				if knob.isInShape(x,y):
-					return knob
+		knobs = [knob for knob in self._knobIndex.query(x, y) if knob.isInShape(x,y)]
+		if len(knobs) > 1: # overlapping nodes, the topmost one wins
+			return min(knobs, key=lambda knob: (self.nodes.index(knob.node), knob.node.knobs.index(knob)))
+		return knobs[0] if knobs else None
 					
 	def pickNode(self, x, y):
-		for node in self.nodes:
-			if node.isInShape(x,y):
-				return node
+		nodes = [node for node in self._nodeIndex.query(x, y) if node.isInShape(x,y)]
+		if len(nodes) > 1:
+			return min(nodes, key=self.nodes.index)
+		return nodes[0] if nodes else None
 					
 	def findConnections(self, knob):
-		for c in self.connections:
-			if c.inputKnob == knob or c.outputKnob == knob:
-				yield c
+		for c in knob.model.connections:
+			yield self._connectionItems[c]
 				
 	def selectNode(self, node):
 		self.selectedNode = node
@@ -386,13 +585,15 @@ class GLFlowEditor(QtOpenGL.QGLWidget):
 		if node.isOutput():
 			raise RuntimeError("Output node must not be deleted")		
 		else:
-			connectionsToDelete = []
 			for knob in node.knobs:	
-				connectionsToDelete.extend(self.findConnections(knob))	
-			self.connections = [c for c in self.connections if c not in connectionsToDelete]
+				for connection in list(self.findConnections(knob)):
+					self.removeConnection(connection)
 				
+			self.graph.removeNode(node.model)
 			self.nodes.remove(node)
+			self.removeFromIndex(node)
 			del node
+			self.signalGraphChanged.emit()
 								
 		
 	def mousePressEvent(self, event):
@@ -422,8 +623,8 @@ class GLFlowEditor(QtOpenGL.QGLWidget):
 					if QtWidgets.QMessageBox.question(self.parent(), "Delete Connection", "Do you really want to delete all connections from this output?", QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No) == QtWidgets.QMessageBox.No:
 						return
 				for connection in connections:
-					self.connections.remove(connection)
-					del connection
+					self.removeConnection(connection)
+				self.signalGraphChanged.emit()
 				self.updateGL()
 				
 	
@@ -468,92 +669,23 @@ class GLFlowEditor(QtOpenGL.QGLWidget):
 				self.selectNode(None)
 		
 	def loadGraph(self, filename):
-		def getKnobByName(node, knobName):
-			for knob in node.knobs:
-				if knob.name == knobName:
-					return knob
-			raise NameError("Knob '" + knobName + "' not present on node '" + node.func.__name__ + "'.")
-	
-		self.nodes = []
-		self.connections = []
-		self.selectedNode = None
-	
-		with open(filename) as file:
-			jsonDict = json.load(file)
-			
-		nodeIDDict = {}
-		for nodeDict in jsonDict["nodes"]:
-			# find function
-			func = None
-			funcs = getRegisteredFunctions()
-			for f in funcs:
-				if f.__name__ == nodeDict["name"]:
-					func = f
-			if not func:
-				raise NotImplementedError("'".join("Function of node ", nodeDict["name"], " is not implemented."))
-			else:
-				self.addNode(func, nodeDict["x"], nodeDict["y"])
-				node = self.nodes[-1]
-				nodeIDDict[int(nodeDict["id"])] = node
-				for propDict in nodeDict["properties"]:
-					if propDict["name"] in node.properties:
-						prop = node.properties[propDict["name"]]
-						if propDict["type"] == prop.type.type.__name__:
-							if prop.hasEditable:
-								node.properties[propDict["name"]] = prop._replace(value = propDict["value"])
-						else:
-							raise TypeError("'".join(["Property ", propDict["name"], " is of type ", prop.type.type.__name__, " instead of ", propDict["type"], "."]))
-					else:
-						raise NameError("'".join("Property ", propDict["name"], " missing in node ", nodeDict["name"], "."))
-		
-		for connDict in jsonDict["connections"]:
-			if connDict["outputNodeID"] in nodeIDDict and connDict["inputNodeID"] in nodeIDDict:
-				inputKnob = getKnobByName(nodeIDDict[connDict["inputNodeID"]], connDict["inputKnobName"])
-				outputKnob = getKnobByName(nodeIDDict[connDict["outputNodeID"]], connDict["outputKnobName"])
-				self.addConnection(FlowConnection(inputKnob, outputKnob, parent = self))
-			else:
-				raise IndexError("Connecting nodes with unused IDs (" + str(connDict["outputNodeID"]) + ", " + str(connDict["inputNodeID"]) + ").")
-			
+		self.graph.load(filename)
 		
-	def saveGraph(self, filename):
-		jsonDict = {}
-		jsonDict["nodes"] = []
-		id = 0
+		self.nodes = [FlowNode(node, self) for node in self.graph.nodes]
+		self._nodeIndex.clear()
+		self._knobIndex.clear()
 		for node in self.nodes:
-			nodeDict = {}
-			id += 1
-			node._exportTempID = id
-			nodeDict["id"] = id
-			nodeDict["name"] = node.func.__name__
-			nodeDict["x"] = node.x
-			nodeDict["y"] = node.y
-			
-			nodeDict["properties"] = []
-			for n, prop in node.properties.items():
-				if prop.hasEditable:
-					propDict = {}
-					propDict["name"] = prop.name
-					propDict["type"] = prop.type.type.__name__
-					propDict["value"] = prop.value
-					nodeDict["properties"].append(propDict)
-				
-			jsonDict["nodes"].append(nodeDict)
-			
-		jsonDict["connections"] = []
-		for conn in self.connections:
-			connDict = {}
-			connDict["outputNodeID"] = conn.outputKnob.node._exportTempID
-			connDict["outputKnobName"] = conn.outputKnob.name
-			connDict["inputNodeID"] = conn.inputKnob.node._exportTempID
-			connDict["inputKnobName"] = conn.inputKnob.name
+			self.updateIndex(node)
+		self.connections = []
+		self._connectionItems = {}
+		knobItems = {knob.model: knob for node in self.nodes for knob in node.knobs}
+		for c in self.graph.connections:
+			connection = FlowConnection(knobItems[c.inputKnob], knobItems[c.outputKnob], parent=self, model=c)
+			self.connections.append(connection)
+			self._connectionItems[c] = connection
 			
-			jsonDict["connections"].append(connDict)
+		self.signalGraphChanged.emit()
+		self.selectNode(None)
 		
-		with open(filename, "w") as file:
-			json.dump(jsonDict, file, indent = 4, sort_keys = True)
-					
-							
-						
-						
-						
-				
\ No newline at end of file
+	def saveGraph(self, filename):
+		self.graph.save(filename)
@@ -0,0 +1,181 @@
+import inspect
+import json
+from collections import namedtuple, OrderedDict
+
+from decorators import *
+from synth import SynthParameters, NodeState, OutputBuffer
+
+# Flow graph without any dependency on Qt or OpenGL, so patches can be loaded and rendered headless.
+# The synthesizer only works on this model, GLFlowEditor wraps it for display and editing.
+
+_Property = namedtuple("Property", ["name", "type", "value", "hasKnob", "hasEditable", "knob"])
+def Property(name, type, value, *, hasKnob=False, hasEditable=True, knob=None):
+	return _Property(name, type, value, hasKnob, hasEditable, knob)
+
+class GraphException(Exception):
+	pass
+
+class Knob:
+	__slots__ = ("node", "type", "index", "name", "connections")
+
+	knobTypeInput = 1
+	knobTypeOutput = 2
+
+	def __init__(self, node, type, name, index=-1):
+		self.node = node
+		self.type = type
+		self.index = index
+		self.name = name
+		self.connections = [] # adjacency index, maintained by FlowGraph
+
+	def isConnected(self):
+		return bool(self.connections)
+
+	def __repr__(self):
+		return "<Knob '%s' of %r>" % (self.name, self.node)
+
+class Node:
+	__slots__ = ("x", "y", "func", "knobs", "properties")
+
+	def __init__(self, func, isOutput=False):
+		self.x = 20
+		self.y = 20
+		self.func = func
+
+		self.knobs = []
+		if not isOutput:
+			self.knobs.append(Knob(self, Knob.knobTypeOutput, "Output"))
+
+		self.properties = OrderedDict()
+		signature = inspect.signature(func)
+		for parameter in signature.parameters.values():
+			property = Property(name=parameter.name, type=parameter.annotation, value=parameter.default)
+
+			if property.type in (SynthParameters, NodeState, OutputBuffer):
+				property = property._replace(hasKnob=False, hasEditable=False)
+			else:
+				property = property._replace(hasKnob=property.type.hasKnob, hasEditable=property.type.hasEditable)
+
+			if property.hasKnob:
+				knob = Knob(self, Knob.knobTypeInput, property.name, len(self.knobs) - (0 if isOutput else 1))
+				self.knobs.append(knob)
+				property = property._replace(knob=knob)
+
+			self.properties[parameter.name] = property
+
+	def getKnob(self, name):
+		for knob in self.knobs:
+			if knob.name == name:
+				return knob
+		raise GraphException("Knob '%s' not present on node '%s'." % (name, self.func.__name__))
+
+	def __repr__(self):
+		return "<Node '%s'>" % self.func.__name__
+
+class Connection:
+	__slots__ = ("inputKnob", "outputKnob")
+
+	def __init__(self, inputKnob, outputKnob):
+		self.inputKnob = inputKnob
+		self.outputKnob = outputKnob
+
+class FlowGraph:
+	def __init__(self, functions=None, outputFunctions=None):
+		self.functions = getRegisteredFunctions() if functions is None else functions
+		self.outputFunctions = getRegisteredOutputFunctions() if outputFunctions is None else outputFunctions
+		self.nodes = []
+		self.connections = []
+
+	def addNode(self, func, x=20, y=20):
+		node = Node(func, func in self.outputFunctions)
+		node.x = x
+		node.y = y
+		self.nodes.append(node)
+		return node
+
+	def removeNode(self, node):
+		for knob in node.knobs:
+			for connection in list(knob.connections):
+				self.removeConnection(connection)
+		self.nodes.remove(node)
+
+	def addConnection(self, connection):
+		if connection.inputKnob.connections:
+			raise GraphException("Knob already connected.")
+		self.connections.append(connection)
+		connection.inputKnob.connections.append(connection)
+		connection.outputKnob.connections.append(connection)
+
+	def removeConnection(self, connection):
+		self.connections.remove(connection)
+		connection.inputKnob.connections.remove(connection)
+		connection.outputKnob.connections.remove(connection)
+
+	def connect(self, outputNode, inputNode, knobName):
+		connection = Connection(inputNode.getKnob(knobName), outputNode.getKnob("Output"))
+		self.addConnection(connection)
+		return connection
+
+	def findConnections(self, knob):
+		return iter(knob.connections)
+
+	def getInputNodes(self, node):
+		# knob name => node connected to that input
+		return {knob.name: knob.connections[0].outputKnob.node for knob in node.knobs if knob.type == Knob.knobTypeInput and knob.connections}
+
+	def clear(self):
+		self.nodes = []
+		self.connections = []
+
+	def load(self, filename):
+		with open(filename) as file:
+			jsonDict = json.load(file)
+
+		self.clear()
+		functions = {func.__name__: func for func in self.functions}
+		nodeIDDict = {}
+		for nodeDict in jsonDict["nodes"]:
+			if nodeDict["name"] not in functions:
+				raise GraphException("Function of node '%s' is not implemented." % nodeDict["name"])
+			node = self.addNode(functions[nodeDict["name"]], nodeDict["x"], nodeDict["y"])
+			nodeIDDict[int(nodeDict["id"])] = node
+			for propDict in nodeDict["properties"]:
+				if propDict["name"] not in node.properties:
+					raise GraphException("Property '%s' missing in node '%s'." % (propDict["name"], nodeDict["name"]))
+				prop = node.properties[propDict["name"]]
+				if propDict["type"] != prop.type.type.__name__:
+					raise GraphException("Property '%s' is of type '%s' instead of '%s'." % (propDict["name"], prop.type.type.__name__, propDict["type"]))
+				if prop.hasEditable:
+					node.properties[propDict["name"]] = prop._replace(value=propDict["value"])
+
+		for connDict in jsonDict["connections"]:
+			if connDict["outputNodeID"] in nodeIDDict and connDict["inputNodeID"] in nodeIDDict:
+				inputKnob = nodeIDDict[connDict["inputNodeID"]].getKnob(connDict["inputKnobName"])
+				outputKnob = nodeIDDict[connDict["outputNodeID"]].getKnob(connDict["outputKnobName"])
+				self.addConnection(Connection(inputKnob, outputKnob))
+			else:
+				raise GraphException("Connecting nodes with unused IDs (%s, %s)." % (connDict["outputNodeID"], connDict["inputNodeID"]))
+
+	def save(self, filename):
+		jsonDict = {"nodes": [], "connections": []}
+		ids = {}
+		for node in self.nodes:
+			ids[node] = len(ids) + 1
+			properties = [{"name": prop.name, "type": prop.type.type.__name__, "value": prop.value} for prop in node.properties.values() if prop.hasEditable]
+			jsonDict["nodes"].append({"id": ids[node], "name": node.func.__name__, "x": node.x, "y": node.y, "properties": properties})
+
+		for conn in self.connections:
+			jsonDict["connections"].append({
+				"outputNodeID": ids[conn.outputKnob.node],
+				"outputKnobName": conn.outputKnob.name,
+				"inputNodeID": ids[conn.inputKnob.node],
+				"inputKnobName": conn.inputKnob.name
+			})
+
+		with open(filename, "w") as file:
+			json.dump(jsonDict, file, indent = 4, sort_keys = True)
+
+def loadGraph(filename):
+	graph = FlowGraph()
+	graph.load(filename)
+	return graph
@@ -1,6 +1,7 @@
 import sys
 import traceback
 import contextlib
+from collections import OrderedDict
 import os, os.path
 
 from PyQt5 import QtCore, QtWidgets, QtGui, uic
@@ -12,6 +13,8 @@ from keymap import getKeyMap
 
 from nodes import *
 import audio
+import export
+import profiler
 
 form, base = uic.loadUiType("mainwindow.ui")
 class MainWindow(form,base):
@@ -26,6 +29,7 @@ class MainWindow(form,base):
 		self.actionPlay.triggered.connect(self.play)
 		
 		self.actionStop.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_MediaStop))		
+		self.actionStop.triggered.connect(audio.stop)
 		
 		self.actionSave.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_DialogSaveButton))
 		self.actionSave.triggered.connect(self.save)		
@@ -36,6 +40,9 @@ class MainWindow(form,base):
 		self.actionExport.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_DialogApplyButton))
 		self.actionExport.triggered.connect(self.export)
 		
+		self.actionProfile.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_FileDialogDetailedView))
+		self.actionProfile.toggled.connect(self.profile)
+		
 		self.tableProperties = PropertyWidget(parent=self)
 		self.layoutDockProperty.layout().addWidget(self.tableProperties)
 		
@@ -44,16 +51,61 @@ class MainWindow(form,base):
 		
 		self.setCentralWidget(self.glFlowEditor)
 		
-		self.synthesizer = Synthesizer()
+		self.synthesizer = Synthesizer(threads=os.cpu_count())
+		self.glFlowEditor.signalGraphChanged.connect(self.graphChanged)
+		self.tableProperties.signalPropertyChanged.connect(self.graphChanged)
+		
+		# notes are prepared once the graph stopped changing for a moment (e.g. while loading a file)
+		self.prepareNotesTimer = QtCore.QTimer(self)
+		self.prepareNotesTimer.setSingleShot(True)
+		self.prepareNotesTimer.setInterval(300)
+		self.prepareNotesTimer.timeout.connect(self.prepareNotes)
+		
+		# renders run in the background too (live playback, notes), the overlay is refreshed periodically
+		self.profileTimer = QtCore.QTimer(self)
+		self.profileTimer.setInterval(500)
+		self.profileTimer.timeout.connect(self.updateProfile)
 		audio.initAudio()
 		
 	def play(self):
-		self.synthesizer.play(self.glFlowEditor)
+		self.synthesizer.play(self.glFlowEditor.graph)
+		
+	def graphChanged(self):
+		self.synthesizer.invalidate()
+		self.prepareNotesTimer.start()
+		
+	def prepareNotes(self):
+		try:
+			self.synthesizer.prepareNotes(self.glFlowEditor.graph, sorted(set(getKeyMap().values())))
+		except SynthException:
+			pass # incomplete graphs are reported when played
 	
 	def export(self):
-		fileName, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export to file", filter="wave files (*.wav);;All files (*.*)")
+		filters = OrderedDict([
+			("16 bit wave files (*.wav)", (export.formatInt16, True)),
+			("24 bit wave files (*.wav)", (export.formatInt24, True)),
+			("32 bit float wave files (*.wav)", (export.formatFloat32, False)),
+		])
+		fileName, selectedFilter = QtWidgets.QFileDialog.getSaveFileName(self, "Export to file", filter=";;".join(filters))
 		if fileName:
-			self.synthesizer.saveToFile(self.glFlowEditor, fileName)
+			format, dither = filters.get(selectedFilter, (export.formatInt16, True))
+			self.synthesizer.saveToFile(self.glFlowEditor.graph, fileName, format, dither)
+			
+	def profile(self, enabled):
+		if enabled:
+			self.synthesizer.profiler = profiler.RenderProfiler()
+			self.profileTimer.start()
+			return
+		self.profileTimer.stop()
+		renderProfiler, self.synthesizer.profiler = self.synthesizer.profiler, None
+		self.glFlowEditor.setProfile([])
+		fileName, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save profile as Chrome trace", filter="Chrome trace (*.json);;All files (*.*)")
+		if fileName:
+			renderProfiler.writeChromeTrace(fileName)
+			
+	def updateProfile(self):
+		if self.synthesizer.profiler:
+			self.glFlowEditor.setProfile(self.synthesizer.profiler.report())
 			
 	def save(self):
 		fileName, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save to file", filter="Möhre Flow Graph (*.mfg);;All files (*.*)")
@@ -80,7 +132,7 @@ class MainWindow(form,base):
 			keyMap = getKeyMap()
 			if event.nativeScanCode() in keyMap:
 				note = keyMap[event.nativeScanCode()]
-				self.synthesizer.playNote(self.glFlowEditor, note)
+				self.synthesizer.playNote(self.glFlowEditor.graph, note)
 				return
 		QtWidgets.QWidget.keyPressEvent(self, event)
 			
@@ -1,131 +1,167 @@
-import wave
 import math
 
 import numpy as np
 
 from decorators import *
 from usernodes import *
-from synth import SynthParameters, SynthException
+from synth import SynthParameters, NodeState, OutputBuffer, SynthException
+import samplecache
+import oscillator
+import wavetable
+
+# Nodes taking an OutputBuffer write their result into it where it is not None. It has the broadcast shape of
+# the stream inputs, in a batch render the engine passes None and the node allocates the result itself.
+
+_random = np.random.default_rng()
 
 # Generators
 
 @registerFunction
-def sin(params:SynthParameters=None, modulation:StreamOrProperty(float)=0.0, frequency:StreamOrProperty(float)=440, amplitude:StreamOrProperty(float)=1.0):
-	t = np.linspace(0.0, params.length, params.samples)
-	return amplitude*np.sin(2 * np.pi * frequency * t + modulation)
+def sin(params:SynthParameters=None, state:NodeState=None, modulation:StreamOrProperty(float)=0.0, frequency:Frequency(float)=440, amplitude:StreamOrProperty(float)=1.0, out:OutputBuffer=None):
+	out = oscillator.buffer(params, out, modulation, frequency, amplitude)
+	phase = oscillator.phase(frequency, params, state, out=out)
+	phase += modulation / (2 * np.pi)
+	return np.multiply(oscillator.sine(phase, out=phase), amplitude, out=out)
 	
 @registerFunction
-def rectangle(params:SynthParameters=None, frequency:StreamOrProperty(float)=440, amplitude:StreamOrProperty(float)=1.0, duty:StreamOrProperty(float)=0.5):
-	t = np.linspace(0.0, params.length, params.samples)*frequency
-	t -= np.floor(t)
-	return np.where(t <= duty, amplitude, -amplitude)
+def rectangle(params:SynthParameters=None, state:NodeState=None, frequency:Frequency(float)=440, amplitude:StreamOrProperty(float)=1.0, duty:StreamOrProperty(float)=0.5, out:OutputBuffer=None):
+	out = oscillator.buffer(params, out, frequency, amplitude, duty)
+	phase = oscillator.phase(frequency, params, state, out=out)
+	return np.multiply(wavetable.pulse(phase, duty, frequency, params.sampleRate, out=phase), amplitude, out=out)
 	
 @registerFunction
 def step(params:SynthParameters=None, stepTime:StreamOrProperty(float)=0.5, fromValue:StreamOrProperty(float)=0.0, toValue:StreamOrProperty(float)=1.0):
-	t = np.linspace(0.0, params.length, params.samples)
-	return np.where(t < stepTime, fromValue, toValue)
+	t = params.time()
+	return np.where(t < stepTime, fromValue, toValue).astype(params.dtype, copy=False)
 	
 @registerFunction	
-def linear(params:SynthParameters=None, startTime:StreamOrProperty(float)=0.0, startValue:StreamOrProperty(float)=0.0, endTime:StreamOrProperty(float)=1.0, endValue:StreamOrProperty(float)=1.0):
-	t = np.linspace(0.0, params.length, params.samples)
+def linear(params:SynthParameters=None, startTime:StreamOrProperty(float)=0.0, startValue:StreamOrProperty(float)=0.0, endTime:StreamOrProperty(float)=1.0, endValue:StreamOrProperty(float)=1.0, out:OutputBuffer=None):
+	t = params.time()
 	slope = (endValue - startValue) / (endTime - startTime)
-	return np.clip(startValue-startTime*slope + slope*t, min(startValue, endValue), max(startValue, endValue))
+	return np.clip(startValue-startTime*slope + slope*t, min(startValue, endValue), max(startValue, endValue), out=out)
 	
 @registerFunction
-def exponential(params:SynthParameters=None, amplitude:StreamOrProperty(float)=1.0, decayConstant:StreamOrProperty(float)=round(math.log(0.5), 2)):
-	t = np.linspace(0.0, params.length, params.samples)
-	return amplitude*np.exp(decayConstant*t)
+def exponential(params:SynthParameters=None, amplitude:StreamOrProperty(float)=1.0, decayConstant:StreamOrProperty(float)=round(math.log(0.5), 2), out:OutputBuffer=None):
+	exponent = np.multiply(params.time(out=out), decayConstant, out=out)
+	return np.multiply(np.exp(exponent, out=exponent), amplitude, out=out)
 	
 @registerFunction
-def sawtooth(params:SynthParameters=None, frequency:StreamOrProperty(float)=440, amplitude:StreamOrProperty(float)=1.0):
-	t = np.linspace(0.0, params.length, params.samples)*frequency
-	return ((t - np.floor(t)) * 2.0 - 1.0) * amplitude
+def sawtooth(params:SynthParameters=None, state:NodeState=None, frequency:Frequency(float)=440, amplitude:StreamOrProperty(float)=1.0, out:OutputBuffer=None):
+	out = oscillator.buffer(params, out, frequency, amplitude)
+	phase = oscillator.phase(frequency, params, state, out=out)
+	return np.multiply(wavetable.saw(phase, frequency, params.sampleRate, out=phase), amplitude, out=out)
 
 @registerFunction	
-def whistle(params:SynthParameters=None, frequency:StreamOrProperty(float)=440, mixValue:StreamOrProperty(float)=0.5, frequencyFactor:StreamOrProperty(float)=10.0, amplitude:StreamOrProperty(float)=1.0):
-	t = np.linspace(0.0, params.length, params.samples)
-	return amplitude*mix(np.sin(2*np.pi*frequency * t), np.sin(2*np.pi*frequency*frequencyFactor * t), mixValue)
+def whistle(params:SynthParameters=None, state:NodeState=None, frequency:Frequency(float)=440, mixValue:StreamOrProperty(float)=0.5, frequencyFactor:StreamOrProperty(float)=10.0, amplitude:StreamOrProperty(float)=1.0, out:OutputBuffer=None):
+	out = oscillator.buffer(params, out, frequency, mixValue, frequencyFactor, amplitude)
+	base = oscillator.phase(frequency, params, state, out=out)
+	overtone = oscillator.phase(frequency*frequencyFactor, params, state, key="overtonePhase")
+	mixed = mix(oscillator.sine(base, out=base), oscillator.sine(overtone, out=overtone), mixValue, out=base)
+	return np.multiply(mixed, amplitude, out=out)
 	
 @registerFunction	
-def triangleSawtooth(params:SynthParameters=None, frequency:StreamOrProperty(float)=440, amplitude:StreamOrProperty(float)=1.0, risingTime:StreamOrProperty(float)=0.5):
-	t = np.linspace(0.0, params.length, params.samples)*frequency
-	t -= np.floor(t)
-	up = None
-	if risingTime < 1e-5:
-		up = amplitude
-	else:
-		up = amplitude * (-1.0 + 2.0/risingTime*t)
-	down = amplitude * (3.0 - 2.0/(1.0-risingTime)*t)
-	return np.where(t < risingTime, up, down)
-	
-@registerFunction
-def whiteNoise(params:SynthParameters=None, amplitude:StreamOrProperty(float)=1.0):
-	return (np.random.rand(params.samples) * 2.0 - 1.0) * amplitude
-	
-@registerFunction
-def fromWaveFile(params:SynthParameters=None, filename:str="testIn.wav", amplitude:StreamOrProperty(float)=1.0):
-	with wave.open(filename) as file:
-		if file.getnchannels() != 1:
-			raise SynthException("Only files with one channel are supported.")
-			return np.zeros(params.samples)
-		else:
-			n = file.getnframes()
-			frames = file.readframes(n)
-			
-			sampTypes = {1: np.uint8, 2:np.int16, 4:np.int32}
-			sampWidth = file.getsampwidth()
-			if sampWidth not in sampTypes:
-				raise SynthException("Only samplewidths of 1, 2 or 4 bytes are supported.")
-			else:
-				maxValue = 2**(sampWidth*8 - 1) - 1
-				data = np.fromstring(frames, dtype = sampTypes[sampWidth]).astype(StreamOrProperty(float)) / maxValue
-				if n > params.samples:
-					data = data[:params.samples]
-				elif n < params.samples:
-					data = np.concatenate((data, np.zeros(params.samples - n)), axis = 0)
-				
-				# sample rate conversion
-				rate = file.getframerate()
-				if rate != params.sampleRate:
-					x = np.linspace(0.0, n / rate, n)
-					nx = np.linspace(0.0, params.length, params.samples)
-					interpolator = interp1d(x, data)
-					data = interpolator(nx)
-					
-				return data
+def triangleSawtooth(params:SynthParameters=None, state:NodeState=None, frequency:Frequency(float)=440, amplitude:StreamOrProperty(float)=1.0, risingTime:StreamOrProperty(float)=0.5, out:OutputBuffer=None):
+	out = oscillator.buffer(params, out, frequency, amplitude, risingTime)
+	phase = oscillator.phase(frequency, params, state, out=out)
+	return np.multiply(wavetable.triangle(phase, risingTime, frequency, params.sampleRate, out=phase), amplitude, out=out)
+	
+@registerFunction
+@randomFunction
+def whiteNoise(params:SynthParameters=None, amplitude:StreamOrProperty(float)=1.0, out:OutputBuffer=None):
+	noise = _random.random(None if out is not None else params.samples, dtype=params.dtype, out=out) # out may have several channels
+	noise *= 2.0
+	noise -= 1.0
+	return np.multiply(noise, amplitude, out=out)
+	
+@registerFunction
+@readsFiles("filename")
+def fromWaveFile(params:SynthParameters=None, filename:PropertyOnly(str)="testIn.wav", amplitude:StreamOrProperty(float)=1.0):
+	# the number of channels comes from the file, so there is no output buffer
+	try:
+		sample = samplecache.getSample(filename, params.sampleRate)
+	except (OSError, samplecache.SampleException) as e:
+		raise SynthException(str(e))
+	return sample.read(params.offset, params.samples, params.dtype) * amplitude
 
 	
 # effects
 	
 @registerFunction
-def constant(params:SynthParameters=None, constant:StreamOrProperty(float)=1.0):
-	ret = np.ndarray(params.samples)
-	ret.fill(constant)
-	return ret
+@pureFunction()
+def constant(constant:StreamOrProperty(float)=1.0):
+	# folded into its consumers when compiling, see Synthesizer._foldStep
+	return constant
 	
 @registerFunction
-def add(signalA:StreamOnly(np.ndarray)=0.0, signalB:StreamOnly(np.ndarray)=0.0):
-	return signalA + signalB
+@pureFunction()
+def add(signalA:StreamOnly(np.ndarray)=0.0, signalB:StreamOnly(np.ndarray)=0.0, out:OutputBuffer=None):
+	return np.add(signalA, signalB, out=out)
 	
 @registerFunction
-def multiply(signalA:StreamOnly(np.ndarray)=0.0, signalB:StreamOnly(np.ndarray)=0.0):
-	return signalA * signalB
+@pureFunction(factors=("signalA", "signalB"))
+def multiply(signalA:StreamOnly(np.ndarray)=0.0, signalB:StreamOnly(np.ndarray)=0.0, out:OutputBuffer=None):
+	return np.multiply(signalA, signalB, out=out)
 	
 @registerFunction
-def clamp(channel:StreamOnly(np.ndarray)=0.0, level:StreamOrProperty(float)=1.0):
-	return np.clip(channel, -level, level)
+@pureFunction()
+def clamp(channel:StreamOnly(np.ndarray)=0.0, level:StreamOrProperty(float)=1.0, out:OutputBuffer=None):
+	return np.clip(channel, -level, level, out=out)
 	
 @registerFunction
-def mix(channelA:StreamOnly(np.ndarray)=0.0, channelB:StreamOnly(np.ndarray)=0.0, mixValue:StreamOrProperty(float)=0.5):
-	return (channelA*(1-mixValue) + channelB*mixValue)
+@pureFunction()
+def mix(channelA:StreamOnly(np.ndarray)=0.0, channelB:StreamOnly(np.ndarray)=0.0, mixValue:StreamOrProperty(float)=0.5, out:OutputBuffer=None):
+	# out may be channelA, but not channelB
+	ret = np.multiply(channelA, 1-mixValue, out=out)
+	return np.add(ret, channelB*mixValue, out=out)
 	
 @registerFunction
-def mix2(channelA:StreamOnly(np.ndarray)=0.0, channelB:StreamOnly(np.ndarray)=0.0, mixA:StreamOrProperty(float)=0.5, mixB:StreamOrProperty(float)=0.5):
-	return (channelA*mixA + channelB*mixB)
+@pureFunction()
+def mix2(channelA:StreamOnly(np.ndarray)=0.0, channelB:StreamOnly(np.ndarray)=0.0, mixA:StreamOrProperty(float)=0.5, mixB:StreamOrProperty(float)=0.5, out:OutputBuffer=None):
+	ret = np.multiply(channelA, mixA, out=out)
+	return np.add(ret, channelB*mixB, out=out)
 	
 @registerFunction
-def delay(params:SynthParameters=None, signal:StreamOnly(np.ndarray)=0.0, delayTime:StreamOrProperty(float)=0.1):
-	zeroLen = int(delayTime * params.sampleRate)
-	return np.append(np.zeros(zeroLen), signal[zeroLen:params.samples])
+def delay(params:SynthParameters=None, state:NodeState=None, signal:StreamOnly(np.ndarray)=0.0, delayTime:StreamOrProperty(float)=0.1):
+	# the delay line holds the samples which are due in the following blocks
+	signal = np.broadcast_to(np.asarray(signal, params.dtype), np.shape(signal)[:-1] + (params.samples,)) # a constant input is a scalar
+	if "line" not in state:
+		state["line"] = np.zeros(np.shape(signal)[:-1] + (int(delayTime * params.sampleRate),), params.dtype)
+	buffered = np.concatenate((state["line"], signal), axis=-1)
+	state["line"] = buffered[..., params.samples:]
+	return buffered[..., :params.samples]
+	
+# channels
+
+def _withChannels(signal, samples):
+	# signal with an explicit channel axis, mono signals and constants get a single channel
+	signal = np.asarray(signal)
+	if signal.ndim < 2:
+		return np.broadcast_to(signal, (1, samples))
+	return signal
+	
+@registerFunction
+def pan(params:SynthParameters=None, signal:StreamOnly(np.ndarray)=0.0, position:StreamOrProperty(float)=0.0):
+	# constant power panning from -1 (left) to 1 (right), both channels of a stereo signal are weighted alike
+	angle = (np.clip(position, -1.0, 1.0) + 1.0) * np.pi / 4
+	gains = np.concatenate((_withChannels(np.cos(angle), params.samples), _withChannels(np.sin(angle), params.samples)), axis=-2)
+	return _withChannels(signal, params.samples) * gains.astype(params.dtype, copy=False)
 	
-#cheapReverb, exponential
\ No newline at end of file
+@registerFunction
+def stereoMix(params:SynthParameters=None, left:StreamOnly(np.ndarray)=0.0, right:StreamOnly(np.ndarray)=0.0):
+	# stereo signal of two mono signals, stereo inputs are downmixed first
+	channels = [_withChannels(signal, params.samples) for signal in (left, right)]
+	channels = [signal.mean(axis=-2, keepdims=True) if signal.shape[-2] > 1 else signal for signal in channels]
+	shape = np.broadcast_shapes(*(signal.shape for signal in channels))
+	return np.concatenate([np.broadcast_to(signal, shape) for signal in channels], axis=-2).astype(params.dtype, copy=False)
+	
+@registerFunction
+def channelSplit(params:SynthParameters=None, signal:StreamOnly(np.ndarray)=0.0, channel:PropertyOnly(int)=0):
+	# a single channel of a multichannel signal, mono signals are on every channel
+	signal = _withChannels(signal, params.samples)
+	if signal.shape[-2] == 1:
+		return signal
+	if not 0 <= channel < signal.shape[-2]:
+		raise SynthException("Channel %d requested from a signal with %d channels." % (channel, signal.shape[-2]))
+	return signal[..., channel:channel+1, :]
+	
+import effects # registers the convolution reverb and filters after the basic nodes
\ No newline at end of file
@@ -0,0 +1,84 @@
+import numpy as np
+
+# Oscillator core shared by the generator nodes. Frequencies are integrated into a phase (in cycles) which is
+# carried from block to block in the node's state, so frequency modulation is correct and continuous.
+# The waveform functions accept an output buffer, passing the phase buffer itself avoids any allocation.
+
+chunkSize = 4096 # samples of float64 phase accumulated at once for float32 outputs
+
+def buffer(params, out, *inputs):
+	# the engine's output buffer, or in batch renders a new one of the broadcast shape of all inputs
+	if out is not None:
+		return out
+	return np.empty(np.broadcast_shapes((params.samples,), *(np.shape(input) for input in inputs)), params.dtype)
+
+def phase(frequency, params, state, key="phase", out=None):
+	# Phase of every sample of the current block, the first sample starts at the phase left by the previous block.
+	# out may have more channels or notes than the frequency, the phase is broadcast into it.
+	start = state.get(key, 0.0)
+	increment = np.asarray(frequency, dtype=float) / params.sampleRate
+	shape = np.broadcast_shapes(np.shape(increment), np.shape(start), (params.samples,))
+	if out is None:
+		out = np.empty(shape, params.dtype)
+	constant = np.shape(increment)[-1:] in ((), (1,))
+
+	if out.dtype == np.float64 and out.shape == shape:
+		end = _accumulate(increment, start, constant, 0, out)
+	else:
+		# The phase is accumulated in float64, float32 can't resolve a cycle after a few thousand cycles. Chunks
+		# keep the float64 scratch small, float32 renders don't need a full length float64 array.
+		work = np.empty(shape[:-1] + (min(chunkSize, params.samples),))
+		end = start
+		for begin in range(0, params.samples, chunkSize):
+			chunk = work[..., :min(chunkSize, params.samples - begin)]
+			end = _accumulate(increment, start if constant else end, constant, begin, chunk)
+			if out.dtype == np.float64:
+				np.copyto(out[..., begin:begin+chunk.shape[-1]], chunk) # broadcast to the channels or notes of out
+			else:
+				np.subtract(chunk, np.floor(chunk), out=out[..., begin:begin+chunk.shape[-1]]) # only the fraction of the cycle matters to the waveforms
+	state[key] = np.mod(end, 1.0) # keeps the phase small, long renders don't lose precision
+	return out
+
+def _accumulate(increment, start, constant, begin, work):
+	# Phase of the samples begin...begin+len of the block into work, returns the phase after the last one. start
+	# is the phase at the first sample of the block for constant frequencies, at sample begin for streams.
+	samples = work.shape[-1]
+	if constant:
+		# constant frequency (per batch row): exact, no accumulated rounding errors
+		np.multiply(np.arange(begin, begin + samples), increment, out=work)
+		work += start
+		return start + increment * (begin + samples)
+	# frequency stream: exclusive running sum of the increments
+	increment = np.broadcast_to(increment, np.broadcast_shapes(np.shape(increment), work.shape[:-1] + (1,)))[..., begin:begin+samples]
+	np.cumsum(increment, axis=-1, out=work)
+	end = start + work[..., -1:]
+	work -= increment
+	work += start
+	return end
+
+def sine(phase, out=None):
+	out = np.multiply(phase, 2.0*np.pi, out=out)
+	return np.sin(out, out=out)
+
+def saw(phase, out=None):
+	# rising from -1 to 1 once per cycle
+	out = np.mod(phase, 1.0, out=out)
+	out *= 2.0
+	out -= 1.0
+	return out
+
+def pulse(phase, duty, out=None):
+	# 1 for the first duty fraction of every cycle, -1 for the rest
+	fraction = np.mod(phase, 1.0, out=out)
+	return np.subtract(2.0 * (fraction <= duty), 1.0, out=fraction)
+
+def triangle(phase, risingTime, out=None):
+	# rising from -1 to 1 during the first risingTime fraction of a cycle, falling back to -1 during the rest
+	fraction = np.mod(phase, 1.0)
+	rising = np.maximum(risingTime, 1e-5)
+	falling = np.maximum(1.0 - risingTime, 1e-5)
+	result = np.where(fraction < risingTime, -1.0 + 2.0*fraction/rising, 1.0 - 2.0*(fraction - risingTime)/falling)
+	if out is None:
+		return result
+	np.copyto(out, result)
+	return out
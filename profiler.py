@@ -0,0 +1,84 @@
+import os
+import json
+import threading
+import time
+from collections import namedtuple, deque
+
+# Opt-in instrumentation of renders: assign a RenderProfiler to Synthesizer.profiler and every evaluated
+# node is timed. The report sums up wall time, calls, output bytes and cache hits per node, the trace keeps
+# the individual calls for chrome://tracing (or https://ui.perfetto.dev).
+
+NodeProfile = namedtuple("NodeProfile", ["node", "name", "calls", "seconds", "bytes", "cacheHits"]) # node: graphmodel.Node
+
+class RenderProfiler:
+	def __init__(self, maxEvents=100000):
+		self._nodes = {} # graphmodel.Node => [name, calls, seconds, bytes, cacheHits]
+		self._events = deque(maxlen=maxEvents) # the latest calls, older ones are dropped during long live playback
+		self._lock = threading.Lock() # steps are evaluated on several threads
+		self._start = time.perf_counter()
+
+	def _entry(self, node):
+		entry = self._nodes.get(node)
+		if entry is None:
+			# nodes of the same function are numbered in order of appearance
+			number = sum(1 for other in self._nodes if other.func is node.func) + 1
+			entry = self._nodes[node] = ["%s #%d" % (node.func.__name__, number), 0, 0.0, 0, 0]
+		return entry
+
+	def _event(self, name, category, start, end=None, args=None):
+		event = {"name": name, "cat": category, "ts": (start - self._start) * 1e6, "pid": os.getpid(), "tid": threading.get_ident()}
+		if end is None:
+			event.update(ph="i", s="t") # instant event of the thread
+		else:
+			event.update(ph="X", dur=(end - start) * 1e6)
+		if args:
+			event["args"] = args
+		self._events.append(event)
+
+	def recordStep(self, node, start, end, result):
+		# start, end: time.perf_counter() before and after the node function
+		nbytes = getattr(result, "nbytes", 0)
+		with self._lock:
+			entry = self._entry(node)
+			entry[1] += 1
+			entry[2] += end - start
+			entry[3] += nbytes
+			self._event(entry[0], "node", start, end, {"bytes": nbytes})
+
+	def recordCacheHit(self, node):
+		with self._lock:
+			entry = self._entry(node)
+			entry[4] += 1
+			self._event(entry[0], "cache", time.perf_counter())
+
+	def recordRender(self, name, start, end, samples):
+		with self._lock:
+			self._event(name, "render", start, end, {"samples": samples})
+
+	def report(self):
+		# NodeProfiles, the most expensive node first
+		with self._lock:
+			profiles = [NodeProfile(node, *entry) for node, entry in self._nodes.items()]
+		return sorted(profiles, key=lambda profile: profile.seconds, reverse=True)
+
+	def chromeTrace(self):
+		with self._lock:
+			return {"traceEvents": list(self._events), "displayTimeUnit": "ms"}
+
+	def writeChromeTrace(self, filename):
+		with open(filename, "w") as file:
+			json.dump(self.chromeTrace(), file)
+
+	def reset(self):
+		with self._lock:
+			self._nodes.clear()
+			self._events.clear()
+			self._start = time.perf_counter()
+
+def formatReport(report):
+	# plain text table of a report
+	total = sum(profile.seconds for profile in report) or 1.0
+	lines = ["%-24s %8s %10s %6s %10s %6s" % ("node", "calls", "ms", "%", "MB", "cached")]
+	for profile in report:
+		lines.append("%-24s %8d %10.2f %6.1f %10.2f %6d" % (profile.name, profile.calls, profile.seconds * 1e3, 100 * profile.seconds / total, profile.bytes / 1e6, profile.cacheHits))
+	return "\n".join(lines)
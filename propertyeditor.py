@@ -1,5 +1,4 @@
 import string
-from collections import namedtuple
 
 from PyQt5 import QtCore, QtWidgets, QtGui, uic
 
@@ -12,15 +11,13 @@ def camelCaseToWords(text):
 			words += " " + char.lower()
 	return words.strip()
 	
-_Property = namedtuple("Property", ["name", "type", "value", "hasKnob", "hasEditable", "knob"])
-def Property(name, type, value, *, hasKnob=False, hasEditable=True, knob=None):
-	return _Property(name, type, value, hasKnob, hasEditable, knob)
-
 class PropertyWidget(QtWidgets.QTableWidget):
 	itemRolePropertyName = QtCore.Qt.UserRole + 1
 	itemRolePropertyType = QtCore.Qt.UserRole + 2
 	itemRolePropertyParse = QtCore.Qt.UserRole + 3
 	
+	signalPropertyChanged = QtCore.pyqtSignal()
+	
 	def __init__(self, parent=None):
 		QtWidgets.QTableWidget.__init__(self, parent)
 		
@@ -67,5 +64,6 @@ class PropertyWidget(QtWidgets.QTableWidget):
 			if name and type:
 				value = type(item.text())
 				self._currentList[name] = self._currentList[name]._replace(value=value)
+				self.signalPropertyChanged.emit()
 					
 				
\ No newline at end of file
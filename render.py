@@ -0,0 +1,87 @@
+import sys
+import os, os.path
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from synth import Synthesizer
+from export import formats, formatInt16
+from graphmodel import loadGraph
+from keymap import getKeyMap
+import profiler
+import nodes # registers the node functions
+
+# Headless batch rendering of Möhre flow graphs (*.mfg) to wave files, e.g.
+#   python render.py -o out/ patches/*.mfg
+
+def renderFile(inputName, outputName, threads, notes, format, dither, profile=False):
+	# runs in a worker process, returns seconds of rendered audio, seconds of wall time and the profile report
+	start = time.perf_counter()
+	graph = loadGraph(inputName)
+	synthesizer = Synthesizer(cacheBytes=0, threads=threads) # every patch is rendered once
+	if profile:
+		synthesizer.profiler = profiler.RenderProfiler()
+	if notes:
+		# one wave file per note, all notes rendered in one pass (patches without frequency inputs are resampled)
+		directory, base = os.path.split(os.path.splitext(outputName)[0])
+		synthesizer.saveNotesToFiles(graph, notes, directory, base + "-", format, dither)
+	else:
+		synthesizer.saveToFile(graph, outputName, format, dither)
+	duration = time.perf_counter() - start
+	report = ""
+	if profile:
+		synthesizer.profiler.writeChromeTrace(os.path.splitext(outputName)[0] + ".trace.json")
+		report = profiler.formatReport(synthesizer.profiler.report())
+	return max(len(notes), 1) * synthesizer.synthParameters.totalSamples / synthesizer.synthParameters.sampleRate, duration, report
+
+def outputNameFor(inputName, outputDirectory):
+	base = os.path.splitext(os.path.basename(inputName))[0] + ".wav"
+	return os.path.join(outputDirectory if outputDirectory else os.path.dirname(inputName), base)
+
+def main(arguments):
+	parser = argparse.ArgumentParser(description="Render Möhre flow graphs to wave files without a GUI.")
+	parser.add_argument("inputs", nargs="+", help="flow graph files (*.mfg)")
+	parser.add_argument("-o", "--output", help="output directory (default: next to each input)")
+	parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes (default: %(default)s)")
+	parser.add_argument("-t", "--threads", type=int, default=1, help="threads evaluating independent nodes per worker (default: %(default)s)")
+	parser.add_argument("-n", "--notes", action="store_true", help="render every note of the keyboard map to <name>-<note>.wav instead")
+	parser.add_argument("-f", "--format", choices=formats, default=formatInt16, help="sample format of the wave files (default: %(default)s)")
+	parser.add_argument("-d", "--dither", action="store_true", help="dither integer sample formats")
+	parser.add_argument("-p", "--profile", action="store_true", help="print the render time of every node and write a Chrome trace to <name>.trace.json")
+	args = parser.parse_args(arguments)
+
+	if args.output:
+		os.makedirs(args.output, exist_ok=True)
+	notes = sorted(set(getKeyMap().values())) if args.notes else []
+
+	failed = 0
+	audioSeconds = 0.0
+	renderSeconds = 0.0
+	start = time.perf_counter()
+	with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+		futures = {executor.submit(renderFile, inputName, outputNameFor(inputName, args.output), args.threads, notes, args.format, args.dither, args.profile): inputName for inputName in args.inputs}
+		for future in as_completed(futures):
+			try:
+				length, duration, report = future.result()
+			except Exception:
+				failed += 1
+				print("%s: failed" % futures[future], file=sys.stderr)
+				traceback.print_exc()
+			else:
+				audioSeconds += length
+				renderSeconds += duration
+				print("%s: %.2f s audio in %.2f s" % (futures[future], length, duration))
+				if report:
+					print(report)
+	elapsed = time.perf_counter() - start
+
+	rendered = len(args.inputs) - failed
+	print("%d files in %.2f s (%.2f files/s), %d failed" % (rendered, elapsed, rendered / elapsed, failed))
+	if audioSeconds:
+		# real-time factor: processing time per second of audio, below 1.0 is faster than real time
+		print("real-time factor %.4f per worker, %.4f overall" % (renderSeconds / audioSeconds, elapsed / audioSeconds))
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+
+import numpy as np
+from scipy.signal import resample_poly
+
+qualityLinear = "linear"
+qualitySinc = "sinc"
+qualityPolyphase = "polyphase"
+
+sincTaps = 16 # zero crossings of the windowed sinc kernel on each side
+_chunkSize = 4096 # outputs of the sinc kernel computed at once, bounds the size of the temporary tap matrix
+
+class _IndexCache:
+	# Integer index and fraction of output samples start...start+count in input coordinates, cached because notes
+	# are resampled with the same lengths and ratios over and over again. Entries take 16 bytes per output sample,
+	# they are evicted least recently used first when they exceed maxBytes.
+	def __init__(self, maxBytes):
+		self.maxBytes = maxBytes
+		self.bytes = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock() # notes are prepared on a background thread
+		
+	def get(self, start, count, ratio):
+		key = (start, count, ratio)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				self._entries.move_to_end(key)
+				return entry
+		
+		positions = np.arange(start, start+count) / ratio
+		indexes = np.floor(positions).astype(np.intp)
+		fractions = positions - indexes
+		indexes.flags.writeable = False
+		fractions.flags.writeable = False
+		entry = (indexes, fractions)
+		nbytes = indexes.nbytes + fractions.nbytes
+		if nbytes > self.maxBytes:
+			return entry
+		with self._lock:
+			if key not in self._entries:
+				self._entries[key] = entry
+				self.bytes += nbytes
+				while self.bytes > self.maxBytes:
+					_, (evictedIndexes, evictedFractions) = self._entries.popitem(last=False)
+					self.bytes -= evictedIndexes.nbytes + evictedFractions.nbytes
+		return entry
+		
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.bytes = 0
+			
+_linearIndexes = _IndexCache(64*1024*1024)
+
+def _sincKernel(x, cutoff):
+	window = np.where(np.abs(x) < sincTaps, 0.5 + 0.5*np.cos(np.pi * x / sincTaps), 0.0) # hann window
+	return cutoff * np.sinc(cutoff * x) * window
+
+class Resampler:
+	# Converts a stream of blocks by ratio = output rate / input rate along the last axis, leading axes are
+	# channels. Input samples still needed by the kernel of upcoming output samples are carried over to the next block.
+	def __init__(self, ratio, quality=qualityLinear):
+		if quality not in (qualityLinear, qualitySinc, qualityPolyphase):
+			raise ValueError("Unknown resampling quality '%s'." % quality)
+		self.ratio = ratio
+		self.quality = quality
+		if quality == qualityLinear:
+			self.left, self.right = 0, 1
+		else: # polyphase filtering needs the whole signal, block-wise it is evaluated by the sinc kernel
+			self.left, self.right = sincTaps - 1, sincTaps
+		self._buffer = None # created with the channels of the first block
+		self._dropped = -self.left # absolute input index of self._buffer[0]
+		self._consumed = 0
+		self._produced = 0
+
+	def process(self, block, final=False):
+		block = np.asarray(block)
+		if self._buffer is None:
+			self._buffer = np.zeros(block.shape[:-1] + (self.left,))
+		self._consumed += block.shape[-1]
+		data = np.concatenate((self._buffer, block), axis=-1)
+		if final:
+			data = np.concatenate((data, np.zeros(block.shape[:-1] + (self.right + 1,))), axis=-1)
+			end = int(self._consumed * self.ratio)
+		else:
+			# last output whose kernel lies completely inside data
+			end = int(np.floor((self._dropped + data.shape[-1] - 1 - self.right) * self.ratio)) + 1
+			end = min(end, int(self._consumed * self.ratio))
+		count = max(0, end - self._produced)
+
+		if self.quality == qualityLinear:
+			output = self._linear(data, count)
+		else:
+			output = self._sinc(data, count)
+		self._produced += count
+
+		drop = max(0, int(np.floor(self._produced / self.ratio)) - self.left - self._dropped)
+		self._buffer = data[..., drop:self._buffer.shape[-1]+block.shape[-1]]
+		self._dropped += drop
+		return output
+
+	def _linear(self, data, count):
+		indexes, fractions = _linearIndexes.get(self._produced, count, self.ratio)
+		indexes = indexes - self._dropped
+		return data[..., indexes] * (1.0 - fractions) + data[..., indexes+1] * fractions
+
+	def _sinc(self, data, count):
+		cutoff = min(1.0, self.ratio) # lowpass below the new nyquist frequency when downsampling
+		offsets = np.arange(-self.left, self.right + 1)
+		output = np.empty(data.shape[:-1] + (count,))
+		for start in range(0, count, _chunkSize):
+			positions = np.arange(self._produced+start, self._produced+min(start+_chunkSize, count)) / self.ratio - self._dropped
+			indexes = np.floor(positions).astype(np.intp)[:, np.newaxis] + offsets
+			output[..., start:start+len(positions)] = np.sum(data[..., indexes] * _sincKernel(positions[:, np.newaxis] - indexes, cutoff), axis=-1)
+		return output
+
+def resample(data, ratio, quality=qualityLinear):
+	# whole buffer conversion along the last axis, the result has int(samples * ratio) samples
+	if quality == qualityPolyphase:
+		fraction = Fraction(ratio).limit_denominator(1000)
+		if abs(fraction - ratio) < 1e-9:
+			return resample_poly(data, fraction.numerator, fraction.denominator, axis=-1)[..., :int(np.shape(data)[-1] * ratio)]
+	return Resampler(ratio, quality).process(data, final=True)
@@ -0,0 +1,141 @@
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import resample
+
+class SampleException(Exception):
+	pass
+
+_formatPCM = 1
+_formatFloat = 3
+_formatExtensible = 0xFFFE
+
+def _readChunks(filename):
+	# returns the fmt chunk and offset and size of the data chunk of a RIFF wave file
+	fmt = None
+	with open(filename, "rb") as file:
+		riff, _, wave = struct.unpack("<4sI4s", file.read(12))
+		if riff != b"RIFF" or wave != b"WAVE":
+			raise SampleException("'%s' is not a wave file." % filename)
+		while True:
+			header = file.read(8)
+			if len(header) < 8:
+				raise SampleException("'%s' has no data chunk." % filename)
+			chunkId, chunkSize = struct.unpack("<4sI", header)
+			if chunkId == b"fmt ":
+				fmt = file.read(chunkSize)
+			elif chunkId == b"data":
+				if fmt is None:
+					raise SampleException("'%s' has no format chunk before its data." % filename)
+				return fmt, file.tell(), min(chunkSize, os.path.getsize(filename) - file.tell())
+			else:
+				file.seek(chunkSize, os.SEEK_CUR)
+			if chunkSize % 2:
+				file.seek(1, os.SEEK_CUR) # chunks are word aligned
+
+class CachedSample:
+	# Raw PCM data is memory mapped, it is only decoded when read. If the sample rate differs from the
+	# target rate, the whole file is decoded and resampled once on the first read. Files with several
+	# channels are read as (channels, samples) signals.
+	def __init__(self, filename, targetRate):
+		fmt, offset, size = _readChunks(filename)
+		formatTag, self.channels, self.rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+		if formatTag == _formatExtensible and len(fmt) >= 26:
+			formatTag = struct.unpack("<H", fmt[24:26])[0]
+		if self.channels < 1:
+			raise SampleException("'%s' has no channels." % filename)
+		self.targetRate = targetRate
+
+		if formatTag == _formatFloat and bits in (32, 64):
+			self._raw = np.memmap(filename, dtype={32: "<f4", 64: "<f8"}[bits], mode="r", offset=offset, shape=(size * 8 // bits // self.channels, self.channels))
+			self._decode = lambda raw, dtype: raw.astype(dtype)
+		elif formatTag == _formatPCM and bits in (8, 16, 24, 32):
+			sampleWidth = bits // 8
+			if bits == 24:
+				self._raw = np.memmap(filename, dtype=np.uint8, mode="r", offset=offset, shape=(size // 3 // self.channels, self.channels, 3))
+				self._decode = self._decode24
+			else:
+				self._raw = np.memmap(filename, dtype={1: "u1", 2: "<i2", 4: "<i4"}[sampleWidth], mode="r", offset=offset, shape=(size // sampleWidth // self.channels, self.channels))
+				if bits == 8: # 8 bit wave files are unsigned
+					self._decode = lambda raw, dtype: (raw.astype(dtype) - 128.0) / 128.0
+				else:
+					self._decode = lambda raw, dtype: raw.astype(dtype) / 2**(bits-1)
+		else:
+			raise SampleException("Unsupported wave format (tag %d, %d bits)." % (formatTag, bits))
+
+		self._resampled = None
+		if self.rate == targetRate:
+			self.frames = len(self._raw)
+		else:
+			self.frames = int(len(self._raw) * targetRate / self.rate)
+
+	@staticmethod
+	def _decode24(raw, dtype):
+		value = raw[..., 0].astype(np.int32) | (raw[..., 1].astype(np.int32) << 8) | (raw[..., 2].astype(np.int8).astype(np.int32) << 16)
+		return value.astype(dtype) / 2**23
+
+	@property
+	def nbytes(self):
+		# mapped bytes count as well, every entry keeps its file open
+		return self._raw.nbytes + (0 if self._resampled is None else self._resampled.nbytes)
+
+	def _signal(self, raw, dtype):
+		# frames are stored interleaved, signals have the channels first
+		decoded = self._decode(raw, dtype)
+		return decoded[:, 0] if self.channels == 1 else decoded.T
+		
+	def read(self, start, count, dtype=np.float64):
+		# decoded samples start...start+count at the target rate, padded with zeros after the end of the file
+		if self.rate == self.targetRate:
+			data = self._signal(self._raw[start:start+count], dtype)
+		else:
+			if self._resampled is None:
+				self._resampled = resample.resample(self._signal(self._raw, np.float64), self.targetRate / self.rate, resample.qualityPolyphase)
+				_cache.evict()
+			data = self._resampled[..., start:start+count].astype(dtype)
+		if data.shape[-1] < count:
+			data = np.concatenate((data, np.zeros(data.shape[:-1] + (count - data.shape[-1],), dtype)), axis=-1)
+		return data
+
+class SampleCache:
+	# Process wide cache of wave files, keyed by path, modification time and target sample rate.
+	# Entries are evicted least recently used first when their mapped and decoded data exceeds maxBytes,
+	# entries of older versions of a file as soon as the file is modified.
+	def __init__(self, maxBytes):
+		self.maxBytes = maxBytes
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, filename, targetRate):
+		path = os.path.abspath(filename)
+		key = (path, os.path.getmtime(path), targetRate)
+		with self._lock:
+			sample = self._entries.get(key)
+			if sample is None:
+				for stale in [other for other in self._entries if other[0] == path and other[1] != key[1]]:
+					del self._entries[stale] # unmaps the old version, so the file can be written again on Windows
+				sample = CachedSample(path, targetRate)
+				self._entries[key] = sample
+			else:
+				self._entries.move_to_end(key)
+				return sample
+		self.evict()
+		return sample
+
+	def evict(self):
+		with self._lock:
+			while len(self._entries) > 1 and sum(sample.nbytes for sample in self._entries.values()) > self.maxBytes:
+				self._entries.popitem(last=False)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+_cache = SampleCache(512*1024*1024)
+
+def getSample(filename, targetRate):
+	return _cache.get(filename, targetRate)
@@ -1,84 +1,519 @@
-import wave
+import os.path
+import functools
+import hashlib
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from scipy.interpolate import interp1d
 import numpy as np
 
 from decorators import *
 import audio
+import export
+import resample
 		
 class SynthParameters:
-	def __init__(self, rate, length):
+	def __init__(self, rate, length, offset=0, samples=None, pitch=None, dtype=np.float64):
 		self.sampleRate = rate
 		self.length = length
-		self.samples = int(length * rate)
+		self.totalSamples = int(length * rate)
+		self.offset = offset # index of the first sample of the current block
+		self.samples = self.totalSamples if samples is None else samples # number of samples in the current block
+		self.pitch = pitch # None or frequency multipliers of shape (notes, 1, 1), one row per note of a batch render
+		self.dtype = np.dtype(dtype) # precision of all signals, see precisions
+		
+	def block(self, offset, samples):
+		return SynthParameters(self.sampleRate, self.length, offset, samples, self.pitch, self.dtype)
+		
+	def batch(self, multipliers):
+		return SynthParameters(self.sampleRate, self.length, self.offset, self.samples, np.asarray(multipliers, dtype=float).reshape(-1, 1, 1), self.dtype)
+		
+	def time(self, out=None):
+		if out is None:
+			out = np.empty(self.samples, self.dtype)
+		# sample indexes are exact in float64 before rounding
+		if self.samples <= _maxCachedIndexes:
+			np.add(_sampleIndexes(self.samples), self.offset, out=out)
+		else: # whole buffer render, a cached array of this length would outlive it
+			np.add(np.arange(self.samples, dtype=float), self.offset, out=out)
+		out /= self.sampleRate
+		return out
+		
+parallelBlockSize = 16384 # smaller blocks (live playback) are evaluated on the calling thread, handing steps to the pool costs more than it saves
+		
+precisions = {"float64": np.float64, "float32": np.float32} # values of the precision property of the Output node
+		
+def _modificationTime(filename):
+	# None for missing files, the node reports the error when it is evaluated
+	try:
+		return os.path.getmtime(filename)
+	except OSError:
+		return None
+		
+_maxCachedIndexes = 65536 # samples, covers the block sizes of live playback and export
+
+@functools.lru_cache(maxsize=16)
+def _sampleIndexes(samples):
+	indexes = np.arange(samples, dtype=float)
+	indexes.flags.writeable = False
+	return indexes
+		
+# Signals are arrays of shape (samples,) for mono or (channels, samples), scalars for constants. Batch renders
+# prepend the note axis to pitched signals: (notes, channels, samples). Nodes operate on the last axis and
+# broadcast the others, so one call processes all channels and notes.
+		
+class NodeState(dict):
+	# per node storage which is carried from one block to the next (phases, delay lines, file positions)
+	pass
+	
+class OutputBuffer(np.ndarray):
+	# Annotation of the parameter receiving a preallocated array for the node's result, None if the engine
+	# can't provide one. It has the broadcast shape of the node's stream inputs and one block, nodes with a
+	# different result shape must not declare it. Nodes should write into it and return it, and must not keep it
+	# (or their inputs) in their state, the array is reused as soon as all consumers of the result have run.
+	pass
 	
 class SynthException(Exception):
 	pass
 	
 @registerOutputFunction # potential parameters: envelope, looping (ping-pong, forward)
-def Output(synthParameters:SynthParameters=None, input:StreamOnly(np.ndarray)=0.0, sampleRate:PropertyOnly(int)=44100, length:PropertyOnly(float)=2.0, playbackSpeedFactor:PropertyOnly(float)=1.0):
-	return input
+def Output(synthParameters:SynthParameters=None, input:StreamOnly(np.ndarray)=0.0, sampleRate:PropertyOnly(int)=44100, length:PropertyOnly(float)=2.0, playbackSpeedFactor:PropertyOnly(float)=1.0, precision:PropertyOnly(str)="float64"):
+	if np.ndim(input) == 0: # constant input
+		return np.full(synthParameters.samples, input, dtype=synthParameters.dtype)
+	if np.ndim(input) == 2 and np.shape(input)[0] == 1: # mono with a channel axis
+		input = input[0]
+	return input.astype(synthParameters.dtype, copy=False)
 	
-class Synthesizer:
+RenderStep = namedtuple("RenderStep", ["node", "func", "arguments", "frequencyArguments", "key"]) # arguments: tuple of (parameter name, argument type, slot)
+
+class RenderPlan(namedtuple("RenderPlan", ["steps", "constants", "inputs", "consumers", "synthParameters", "playbackSpeedFactor", "files"])): # inputs/consumers: step indexes per step, files: (path, modification time) of every file read by a node
+	argumentSynthParameters = 0
+	argumentConstant = 1 # slot indexes the constant table
+	argumentStep = 2 # slot indexes the result of a previous step
+	argumentState = 3
+	argumentOutputBuffer = 4
+	
+class BufferPool:
+	# Free block sized arrays by shape, results are released by Synthesizer._finishStep after their last consumer ran.
+	# The pool is kept from block to block and cleared after every render.
 	def __init__(self):
+		self._free = {}
+		self._lock = threading.Lock() # steps are evaluated on several threads
+		
+	def acquire(self, shape, dtype):
+		key = (shape, np.dtype(dtype))
+		with self._lock:
+			free = self._free.get(key)
+			if free:
+				return free.pop()
+		return np.empty(shape, dtype)
+		
+	def release(self, buffer):
+		with self._lock:
+			self._free.setdefault((buffer.shape, buffer.dtype), []).append(buffer)
+			
+	def clear(self):
+		with self._lock:
+			self._free.clear()
+	
+class RenderCache:
+	# least recently used cache of node output buffers, keyed by RenderStep.key
+	def __init__(self, maxBytes):
+		self.maxBytes = maxBytes
+		self.bytes = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock() # notes are rendered on a background thread
+		
+	def get(self, key):
+		with self._lock:
+			buffer = self._entries.get(key)
+			if buffer is not None:
+				self._entries.move_to_end(key)
+			return buffer
+		
+	def put(self, key, buffer):
+		# returns whether the cache keeps the buffer
+		if not isinstance(buffer, np.ndarray) or buffer.nbytes > self.maxBytes:
+			return False
+		with self._lock:
+			if key in self._entries:
+				return False
+			buffer.flags.writeable = False # shared with later renders, nodes must not modify it in place
+			self._entries[key] = buffer
+			self.bytes += buffer.nbytes
+			while self.bytes > self.maxBytes:
+				_, evicted = self._entries.popitem(last=False)
+				self.bytes -= evicted.nbytes
+			return True
+			
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.bytes = 0
+		
+	def __len__(self):
+		return len(self._entries)
+	
+class Synthesizer:
+	def __init__(self, cacheBytes=256*1024*1024, resampleQuality=resample.qualityLinear, threads=1, noteBytes=256*1024*1024):
 		self.soundBuffer = None
 		self.synthParameters = None
 		self.playbackSpeedFactor = 1.0
+		self.cache = RenderCache(cacheBytes)
+		self.pool = BufferPool()
+		self.resampleQuality = resampleQuality # used for pitch shifting notes
+		self.executor = ThreadPoolExecutor(threads) if threads > 1 else None # evaluates independent nodes concurrently
+		self.livePlayback = None
+		self.noteBuffers = RenderCache(noteBytes) # (output key of the plan, note) => playback buffer in the layout of audio.playbackBuffer
+		self._noteKey = None # output key of the plan the note buffers belong to
+		self.plan = None
+		self._planFlowGraph = None
+		self.profiler = None # profiler.RenderProfiler recording every evaluated node, off by default
 		
-	def _workNode(self, node, flowGraph, previous = []):
-		inputs = {}
-		for knob in node.knobs:
-			if knob.type == knob.knobTypeInput:
-				for connection in flowGraph.findConnections(knob):
-					if connection.outputKnob.node in previous:
-						raise SynthException("No loops allowed in graph.")
-					else:
-						# trim buffer in length
-						inputs[knob.name] = self._workNode(connection.outputKnob.node, flowGraph, previous + [node])
+	def invalidate(self):
+		# called whenever nodes, connections or properties of the flow graph change
+		self.plan = None
+		self._planFlowGraph = None
+		self.pool.clear() # the length of the output might have changed
 		
-		parameters = {}
+	def _sortGraph(self, outputNode, flowGraph):
+		# depth first topological sort, every node reachable from the output appears exactly once and after all of its inputs
+		order = []
+		finished = set()
+		active = set()
+		def visit(node):
+			if node in active:
+				raise SynthException("No loops allowed in graph.")
+			elif node not in finished:
+				active.add(node)
+				for inputNode in flowGraph.getInputNodes(node).values():
+					visit(inputNode)
+				active.remove(node)
+				finished.add(node)
+				order.append(node)
+		visit(outputNode)
+		return order
+		
+	def _compileNode(self, node, flowGraph, synthParameters, steps, stepIndexes, constants, folded, files):
+		inputs = flowGraph.getInputNodes(node)
+		
+		arguments = []
+		keyValues = [node.func.__module__, node.func.__qualname__]
+		if getattr(node.func, "isRandom", False):
+			keyValues.append(id(node)) # equal properties don't give equal results
+		for name in getattr(node.func, "fileParameters", ()):
+			if node.properties[name].value: # reverb without impulse response file
+				path = os.path.abspath(node.properties[name].value)
+				files.append((path, _modificationTime(path)))
+				keyValues.append((name, files[-1]))
 		signature = inspect.signature(node.func)
 		for parameter in signature.parameters.values():
 			property = node.properties[parameter.name]
 			if property.type == SynthParameters:
-				parameters[parameter.name] = self.synthParameters
+				arguments.append((parameter.name, RenderPlan.argumentSynthParameters, None))
+				keyValues.append((parameter.name, synthParameters.sampleRate, synthParameters.length, synthParameters.dtype.str))
+			elif property.type == NodeState:
+				arguments.append((parameter.name, RenderPlan.argumentState, None))
+			elif property.type == OutputBuffer:
+				arguments.append((parameter.name, RenderPlan.argumentOutputBuffer, None))
+			elif property.name in inputs and inputs[property.name] in folded:
+				arguments.append((parameter.name, RenderPlan.argumentConstant, len(constants)))
+				constants.append(folded[inputs[property.name]])
+				keyValues.append((parameter.name, folded[inputs[property.name]]))
 			elif property.name in inputs:
-				parameters[parameter.name] = inputs[parameter.name]
+				slot = stepIndexes[inputs[property.name]]
+				arguments.append((parameter.name, RenderPlan.argumentStep, slot))
+				keyValues.append((parameter.name, steps[slot].key))
 			elif property.hasEditable:
-				parameters[parameter.name] = node.properties[parameter.name].value
-			elif property.hasKnob: # knob not connected, else it would be in inputs
-				parameters[parameter.name] = np.ndarray(self.synthParameters.samples)
-				parameters[parameter.name].fill(parameter.default)
-				
-		return node.func(**parameters)
+				arguments.append((parameter.name, RenderPlan.argumentConstant, len(constants)))
+				constants.append(property.value)
+				keyValues.append((parameter.name, property.value))
+			elif property.hasKnob: # knob not connected, else it would be in inputs. Nodes get the default as a scalar.
+				arguments.append((parameter.name, RenderPlan.argumentConstant, len(constants)))
+				constants.append(parameter.default)
+				keyValues.append((parameter.name, parameter.default))
+		frequencyArguments = frozenset(name for name, property in node.properties.items() if isinstance(property.type, ParameterType) and property.type.isFrequency)
+		# The key only changes if a property of this node or of any node upstream changes. It is a digest of the
+		# exact values, hash() maps different values to the same number (hash(-1) == hash(-2)).
+		key = hashlib.sha1(repr(tuple(keyValues)).encode()).hexdigest()
+		return RenderStep(node, node.func, tuple(arguments), frequencyArguments, key)
 		
-	def synthesizeFromFlowGraph(self, flowGraph):
+	def _foldStep(self, step, constants):
+		# returns ("constant", value) if the step can be evaluated now, ("forward", slot) if it passes the
+		# result of another step through unchanged, or None if it has to be rendered
+		if not getattr(step.func, "isPure", False) or step.frequencyArguments: # frequencies change with the note
+			return None
+		values = {}
+		streams = {}
+		for name, argumentType, slot in step.arguments:
+			if argumentType == RenderPlan.argumentConstant:
+				values[name] = constants[slot]
+			elif argumentType == RenderPlan.argumentStep:
+				streams[name] = slot
+			elif argumentType == RenderPlan.argumentOutputBuffer:
+				values[name] = None
+			else:
+				return None
+		
+		if not streams:
+			value = step.func(**values)
+			return ("constant", value) if np.ndim(value) == 0 else None
+		constantFactors = [values[name] for name in step.func.factors if name in values]
+		if any(np.ndim(factor) == 0 and factor == 0 for factor in constantFactors):
+			return ("constant", 0.0)
+		if len(streams) == 1 and all(factor == 1 for factor in constantFactors):
+			name, slot = next(iter(streams.items()))
+			others = [other for other in values if values[other] is not None]
+			if name in step.func.factors and set(others) <= set(step.func.factors):
+				return ("forward", slot)
+		return None
+		
+	def _pruneSteps(self, steps):
+		# folding can leave steps without consumers, e.g. the input of a multiplication by 0
+		live = [False] * len(steps)
+		live[-1] = True
+		for i in reversed(range(len(steps))):
+			if live[i]:
+				for _, argumentType, slot in steps[i].arguments:
+					if argumentType == RenderPlan.argumentStep:
+						live[slot] = True
+		newIndexes = {}
+		pruned = []
+		for i, step in enumerate(steps):
+			if live[i]:
+				arguments = tuple((name, argumentType, newIndexes[slot] if argumentType == RenderPlan.argumentStep else slot) for name, argumentType, slot in step.arguments)
+				pruned.append(step._replace(arguments=arguments))
+				newIndexes[i] = len(pruned) - 1
+		return pruned
+		
+	def compile(self, flowGraph):
 		outputNodes = [node for node in flowGraph.nodes if node.func in flowGraph.outputFunctions]
 		if len(outputNodes) != 1:
 			raise SynthException("Exactly one Output node required.")
 		else:
-			self.synthParameters = SynthParameters(outputNodes[0].properties["sampleRate"].value, outputNodes[0].properties["length"].value)
-			self.playbackSpeedFactor = outputNodes[0].properties["playbackSpeedFactor"].value
-			self.soundBuffer = self._workNode(outputNodes[0], flowGraph)
+			precision = outputNodes[0].properties["precision"].value
+			if precision not in precisions:
+				raise SynthException("Unknown precision '%s', use one of %s." % (precision, ", ".join(precisions)))
+			synthParameters = SynthParameters(outputNodes[0].properties["sampleRate"].value, outputNodes[0].properties["length"].value, dtype=precisions[precision])
+			playbackSpeedFactor = outputNodes[0].properties["playbackSpeedFactor"].value
 			
-	def saveToFile(self, flowGraph, filename):
-		self.synthesizeFromFlowGraph(flowGraph)
-		with wave.open(filename, 'wb') as file:
-			file.setnchannels(1)
-			file.setsampwidth(2)
-			file.setframerate(self.synthParameters.sampleRate)
-			file.setnframes(self.synthParameters.samples)
-			clamped = np.clip(self.soundBuffer, -1.0, 1.0)
-			scaled = np.int16(clamped*32767)
-			file.writeframesraw(scaled.tobytes()) # normal writeframes doesn't work even though written frames and nframes are equal?
+			# the output node is always the last step
+			steps = []
+			constants = []
+			stepIndexes = {}
+			folded = {} # node => constant result, consumers get it as a constant argument instead of a step
+			files = []
+			for node in self._sortGraph(outputNodes[0], flowGraph):
+				step = self._compileNode(node, flowGraph, synthParameters, steps, stepIndexes, constants, folded, files)
+				folding = self._foldStep(step, constants)
+				if folding is None:
+					steps.append(step)
+					stepIndexes[node] = len(steps) - 1
+				elif folding[0] == "constant":
+					folded[node] = folding[1]
+				else:
+					stepIndexes[node] = folding[1]
+			steps = self._pruneSteps(steps)
+			inputs = tuple(frozenset(slot for _, argumentType, slot in step.arguments if argumentType == RenderPlan.argumentStep) for step in steps)
+			consumers = tuple(tuple(j for j in range(len(steps)) if i in inputs[j]) for i in range(len(steps)))
+			return RenderPlan(tuple(steps), tuple(constants), inputs, consumers, synthParameters, playbackSpeedFactor, tuple(files))
+			
+	def getPlan(self, flowGraph):
+		# files modified on disk change the keys of their nodes and everything downstream
+		if self.plan is None or self._planFlowGraph is not flowGraph or any(_modificationTime(path) != time for path, time in self.plan.files):
+			self.plan = self.compile(flowGraph)
+			self._planFlowGraph = flowGraph
+		return self.plan
+		
+	def _runStep(self, plan, step, synthParameters, state, results):
+		# returns the result and whether it is a buffer of the pool
+		parameters = {}
+		out = None
+		for name, argumentType, slot in step.arguments:
+			if argumentType == RenderPlan.argumentSynthParameters:
+				parameters[name] = synthParameters
+			elif argumentType == RenderPlan.argumentConstant:
+				parameters[name] = plan.constants[slot]
+			elif argumentType == RenderPlan.argumentStep:
+				parameters[name] = results[slot]
+			elif argumentType == RenderPlan.argumentState:
+				parameters[name] = state
+			elif argumentType == RenderPlan.argumentOutputBuffer:
+				# the shape of a batch result depends on which inputs are pitched, those nodes allocate themselves
+				if synthParameters.pitch is None:
+					shape = np.broadcast_shapes((synthParameters.samples,), *(np.shape(results[slot]) for _, argumentType, slot in step.arguments if argumentType == RenderPlan.argumentStep))
+					out = self.pool.acquire(shape, synthParameters.dtype)
+				parameters[name] = out
+		if synthParameters.pitch is not None:
+			for name in step.frequencyArguments:
+				parameters[name] = parameters[name] * synthParameters.pitch
+		if self.profiler:
+			start = time.perf_counter()
+			result = step.func(**parameters)
+			self.profiler.recordStep(step.node, start, time.perf_counter(), result)
+		else:
+			result = step.func(**parameters)
+		
+		if out is not None and out is not result and not np.may_share_memory(out, result):
+			self.pool.release(out)
+		return result, out is not None and out is result
+		
+	def _finishStep(self, plan, i, results, owned, remaining):
+		# gives the results of the inputs of step i back to the pool once their last consumer has run,
+		# unless a consumer returned the buffer (or a view of it) as its own result
+		for slot in plan.inputs[i]:
+			remaining[slot] -= 1
+			if remaining[slot] == 0 and owned[slot]:
+				if not any(np.may_share_memory(results[consumer], results[slot]) for consumer in plan.consumers[slot] if results[consumer] is not None):
+					self.pool.release(results[slot])
+					results[slot] = None
+		
+	def render(self, plan):
+		results = [None] * len(plan.steps)
+		
+		# walk backwards from the output, inputs of cached steps are not needed at all
+		needed = [False] * len(plan.steps)
+		needed[-1] = True
+		for i in reversed(range(len(plan.steps))):
+			if needed[i]:
+				results[i] = self.cache.get(plan.steps[i].key)
+				if results[i] is None:
+					for slot in plan.inputs[i]:
+						needed[slot] = True
+				elif self.profiler:
+					self.profiler.recordCacheHit(plan.steps[i].node)
+		
+		pending = [i for i in range(len(plan.steps)) if needed[i] and results[i] is None]
+		self._evaluate(plan, plan.synthParameters, pending, results, self.cache)
+		self.pool.clear() # whole length buffers are not kept between renders
+		return results[-1]
+		
+	def renderBatch(self, plan, multipliers):
+		# renders one variant per frequency multiplier in a single pass, frequency inputs are broadcast
+		# along the first axis. Returns an array of shape (len(multipliers), samples), or
+		# (len(multipliers), channels, samples) for multichannel output.
+		synthParameters = plan.synthParameters.batch(multipliers)
+		results = [None] * len(plan.steps)
+		self._evaluate(plan, synthParameters, range(len(plan.steps)), results, None)
+		result = results[-1]
+		channels = 1 if result.ndim == 1 else result.shape[-2]
+		if channels == 1:
+			return np.array(np.broadcast_to(result.reshape(result.shape[:-2] + result.shape[-1:]) if result.ndim == 3 else result, (len(multipliers), synthParameters.samples)))
+		return np.array(np.broadcast_to(result, (len(multipliers), channels, synthParameters.samples)))
+		
+	def _evaluate(self, plan, synthParameters, pending, results, cache, states=None):
+		# every step is evaluated at most once, shared subgraphs reuse the buffer of the first evaluation
+		start = time.perf_counter()
+		pendingSet = set(pending)
+		remaining = [sum(1 for consumer in plan.consumers[i] if consumer in pendingSet) for i in range(len(plan.steps))]
+		owned = [False] * len(plan.steps)
+		if self.executor and (states is None or synthParameters.samples >= parallelBlockSize):
+			self._renderParallel(plan, synthParameters, pending, results, cache, owned, remaining, states)
+		else:
+			for i in pending:
+				results[i], owned[i] = self._runStep(plan, plan.steps[i], synthParameters, states[i] if states else NodeState(), results)
+				if cache is not None and cache.put(plan.steps[i].key, results[i]):
+					owned[i] = False # cached buffers are shared with later renders
+				self._finishStep(plan, i, results, owned, remaining)
+		if self.profiler:
+			name = "batch" if synthParameters.pitch is not None else "block" if states else "render"
+			self.profiler.recordRender(name, start, time.perf_counter(), synthParameters.samples)
+		
+	def _renderParallel(self, plan, synthParameters, pending, results, cache, owned, remaining, states):
+		# A step is submitted as soon as all of its inputs are finished. Every step writes only its own result
+		# slot and arguments are bound by name, so the outcome does not depend on the order of completion.
+		waitingFor = {i: set(slot for slot in plan.inputs[i] if results[slot] is None) for i in pending}
+		ready = [i for i in pending if not waitingFor[i]]
+		running = {}
+		while ready or running:
+			for i in ready:
+				running[self.executor.submit(self._runStep, plan, plan.steps[i], synthParameters, states[i] if states else NodeState(), results)] = i
+			ready = []
+			done, _ = wait(running, return_when=FIRST_COMPLETED)
+			for future in done:
+				i = running.pop(future)
+				results[i], owned[i] = future.result()
+				if cache is not None and cache.put(plan.steps[i].key, results[i]):
+					owned[i] = False
+				self._finishStep(plan, i, results, owned, remaining)
+				for consumer in plan.consumers[i]:
+					if consumer in waitingFor:
+						waitingFor[consumer].discard(i)
+						if not waitingFor[consumer]:
+							ready.append(consumer)
+		
+	def renderBlocks(self, plan, blockSize=1024):
+		# generator yielding the output in blocks of blockSize samples, only one block per node is kept in memory
+		# and buffers are recycled from block to block
+		states = [NodeState() for step in plan.steps]
+		for offset in range(0, plan.synthParameters.totalSamples, blockSize):
+			synthParameters = plan.synthParameters.block(offset, min(blockSize, plan.synthParameters.totalSamples - offset))
+			results = [None] * len(plan.steps)
+			self._evaluate(plan, synthParameters, range(len(plan.steps)), results, None, states)
+			yield results[-1]
+		self.pool.clear()
+			
+	def synthesizeBlocks(self, flowGraph, blockSize=1024):
+		plan = self.getPlan(flowGraph)
+		self.synthParameters = plan.synthParameters
+		self.playbackSpeedFactor = plan.playbackSpeedFactor
+		return self.renderBlocks(plan, blockSize)
+		
+	def synthesizeFromFlowGraph(self, flowGraph):
+		plan = self.getPlan(flowGraph)
+		self.synthParameters = plan.synthParameters
+		self.playbackSpeedFactor = plan.playbackSpeedFactor
+		self.soundBuffer = self.render(plan)
+			
+	def saveToFile(self, flowGraph, filename, format=export.formatInt16, dither=False, blockSize=65536):
+		# streams the output to the file block by block, unless it is cached already
+		plan = self.getPlan(flowGraph)
+		cached = self.cache.get(plan.steps[-1].key)
+		if cached is not None:
+			self.synthParameters = plan.synthParameters
+			export.writeWave(filename, cached, self.synthParameters.sampleRate, format, dither)
+			return
+		with export.WaveWriter(filename, plan.synthParameters.sampleRate, format, dither) as writer:
+			for block in self.synthesizeBlocks(flowGraph, blockSize):
+				writer.write(block)
+		
+	def synthesizeNotes(self, flowGraph, notes):
+		# One buffer per note, see renderBatch. Without any frequency input (e.g. sample based patches) the batch
+		# would render the same buffer for every note, those are resampled like playNote does.
+		plan = self.getPlan(flowGraph)
+		self.synthParameters = plan.synthParameters
+		multipliers = [self.noteToMultiplier(note) for note in notes]
+		if not any(step.frequencyArguments for step in plan.steps):
+			buffer = self.render(plan)
+			return [self._playbackBuffer(buffer, multiplier) for multiplier in multipliers]
+		return self.renderBatch(plan, multipliers)
+		
+	def saveNotesToFiles(self, flowGraph, notes, directory, prefix="", format=export.formatInt16, dither=False):
+		# writes <directory>/<prefix><note>.wav for every note, all of them rendered in one pass
+		for note, buffer in zip(notes, self.synthesizeNotes(flowGraph, notes)):
+			export.writeWave(os.path.join(directory, prefix + note + ".wav"), buffer, self.synthParameters.sampleRate, format, dither)
 	
 	def play(self, flowGraph, additionalSpeedModifier=1.0):
+		plan = self.getPlan(flowGraph)
+		if plan.playbackSpeedFactor*additionalSpeedModifier == 1.0 and self.cache.get(plan.steps[-1].key) is None:
+			# nothing to resample, start playing after the first block instead of waiting for the whole render
+			self.playLive(flowGraph)
+			return
 		self.synthesizeFromFlowGraph(flowGraph)
-		xUnscaled = np.linspace(0, self.synthParameters.length, self.synthParameters.samples)
-		xScaled = np.linspace(0, self.synthParameters.length, self.synthParameters.samples / (self.playbackSpeedFactor*additionalSpeedModifier))
-		interpolator = interp1d(xUnscaled, self.soundBuffer)
-		playbackBuffer = interpolator(xScaled)
-		audio.play(playbackBuffer, self.synthParameters.sampleRate)
+		audio.play(self._playbackBuffer(self.soundBuffer, self.playbackSpeedFactor*additionalSpeedModifier), self.synthParameters.sampleRate)
+		
+	def _playbackBuffer(self, buffer, speedFactor):
+		if speedFactor == 1.0:
+			return buffer
+		return resample.resample(buffer, 1.0 / speedFactor, self.resampleQuality)
+		
+	def playLive(self, flowGraph, blockSize=1024, bufferSize=16384):
+		# the returned playback reports underruns, bufferSize is in samples
+		if self.livePlayback:
+			self.livePlayback.stop()
+		self.livePlayback = audio.playLive(self.synthesizeBlocks(flowGraph, blockSize), self.synthParameters.sampleRate, bufferSize)
+		return self.livePlayback
 		
 	@staticmethod
 	def noteToMultiplier(note):
@@ -101,7 +536,38 @@ class Synthesizer:
 		factor = 2**((n-49)/12)
 		return factor
 
+	def _renderNote(self, plan, note):
+		return audio.playbackBuffer(self._playbackBuffer(self.render(plan), plan.playbackSpeedFactor*self.noteToMultiplier(note)))
+		
+	def prepareNotes(self, flowGraph, notes):
+		# Renders the playback buffers of the notes on a background thread, so playNote only has to start the stream.
+		# Notes beyond noteBytes are not prepared, they are rendered when played.
+		plan = self.getPlan(flowGraph)
+		key = plan.steps[-1].key
+		if key != self._noteKey:
+			self.noteBuffers.clear()
+			self._noteKey = key
+		
+		def prepare():
+			for note in notes:
+				if self.plan is not plan:
+					return # the graph changed, a newer preparation takes over
+				if self.noteBuffers.get((key, note)) is None:
+					try:
+						buffer = self._renderNote(plan, note)
+					except Exception:
+						return # errors are reported when the note is actually played
+					if self.noteBuffers.bytes + buffer.nbytes > self.noteBuffers.maxBytes:
+						return # keep the notes prepared so far instead of evicting them
+					self.noteBuffers.put((key, note), buffer)
+		threading.Thread(target=prepare, daemon=True).start()
+		
 	def playNote(self, flowGraph, note):
-		factor = self.noteToMultiplier(note)
-		self.play(flowGraph, additionalSpeedModifier=factor)
+		plan = self.getPlan(flowGraph)
+		buffer = self.noteBuffers.get((plan.steps[-1].key, note))
+		if buffer is not None:
+			audio.play(buffer, plan.synthParameters.sampleRate)
+		else:
+			factor = self.noteToMultiplier(note)
+			self.play(flowGraph, additionalSpeedModifier=factor)
 	
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import threading
+
+import numpy as np
+
+import oscillator
+
+# Band-limited oscillators. Every waveform has one table per octave which only contains the harmonics below
+# the Nyquist frequency for the highest pitch of that octave. Tables are built once per shape and sample rate
+# and stored on disk, rendering is a linear interpolated lookup at the oscillator phase.
+
+tableSize = 2048 # samples per cycle, table rows carry one extra sample so interpolation never wraps
+lowestFrequency = 20.0 # the first octave covers lowestFrequency...2*lowestFrequency
+cacheDirectory = os.path.join(os.path.expanduser("~"), ".cache", "moehre", "wavetables")
+risingTimeSteps = 64 # triangle tables exist for risingTime in multiples of 1/risingTimeSteps
+dutySteps = 256 # pulse tables exist for duty in multiples of 1/dutySteps
+
+_oversampling = 16 # naive cycles are sampled this much finer before their spectrum is truncated
+_version = 1 # part of the cache file name, increase when the table layout changes
+
+def _naiveSaw(phase):
+	return 2.0 * phase - 1.0
+
+def _naiveTriangle(risingTime):
+	def shape(phase):
+		return oscillator.triangle(phase, risingTime)
+	return shape
+
+def _naivePulse(duty):
+	def shape(phase):
+		return np.where(phase < duty, 1.0, -1.0) # constant for duty 0 and 1, oscillator.pulse is 1 at phase 0
+	return shape
+
+class WavetableBank:
+	def __init__(self, name, shape, sampleRate):
+		self.name = name
+		self.sampleRate = sampleRate
+		self.octaves = max(1, int(np.ceil(np.log2(sampleRate / 2.0 / lowestFrequency))))
+
+		filename = os.path.join(cacheDirectory, "%s-%d-%d-v%d.npy" % (name, sampleRate, tableSize, _version))
+		try:
+			tables = np.load(filename)
+			if tables.shape != (self.octaves, tableSize + 1):
+				raise ValueError("stale wavetable file")
+		except (OSError, ValueError):
+			tables = self._build(shape)
+			try:
+				os.makedirs(cacheDirectory, exist_ok=True)
+				temporary = "%s.%d.tmp" % (filename, os.getpid())
+				with open(temporary, "wb") as file:
+					np.save(file, tables)
+				os.replace(temporary, filename) # several render processes may build the same bank
+			except OSError:
+				pass # the tables are only cached, rendering works without a writable cache directory
+
+		self.tables = tables.ravel()
+		self.slopes = np.append(np.diff(self.tables), 0.0) # slope to the next sample, read at the same index
+		self.tables.flags.writeable = False
+		self.slopes.flags.writeable = False
+		self._tables32 = (self.tables.astype(np.float32), self.slopes.astype(np.float32)) # for float32 renders
+
+	def _build(self, shape):
+		cycle = shape(np.arange(tableSize * _oversampling) / (tableSize * _oversampling))
+		spectrum = np.fft.rfft(cycle) / len(cycle)
+		tables = np.empty((self.octaves, tableSize + 1))
+		for octave in range(self.octaves):
+			highest = lowestFrequency * 2.0**(octave + 1)
+			harmonics = int(np.clip(self.sampleRate / 2.0 / highest, 1, tableSize // 2 - 1))
+			truncated = np.zeros(tableSize // 2 + 1, dtype=complex)
+			truncated[:harmonics+1] = spectrum[:harmonics+1]
+			tables[octave, :tableSize] = np.fft.irfft(truncated, tableSize) * tableSize
+			tables[octave, tableSize] = tables[octave, 0]
+		return tables
+
+	def octave(self, frequency):
+		ratio = np.maximum(np.abs(frequency), lowestFrequency) / lowestFrequency
+		return np.minimum(np.log2(ratio).astype(np.intp), self.octaves - 1)
+
+	def render(self, phase, frequency, out=None):
+		# np.mod is slow, the table size is a power of two so the integer index can be wrapped by masking
+		position = np.multiply(phase, tableSize, out=out)
+		index = position.astype(np.intp) # rounds towards zero, cheaper than np.floor and a second conversion
+		index -= position < index # floor of negative positions
+		position -= index # now the fraction between index and index+1
+		index &= tableSize - 1
+		if np.ndim(frequency) == 0:
+			index += self.octave(frequency) * (tableSize + 1)
+		else:
+			index += np.broadcast_to(self.octave(frequency) * (tableSize + 1), index.shape)
+		tables, slopes = self._tables32 if position.dtype == np.float32 else (self.tables, self.slopes)
+		position *= slopes.take(index)
+		position += tables.take(index)
+		return position
+
+class _BankCache:
+	def __init__(self):
+		self._banks = {}
+		self._lock = threading.Lock()
+
+	def get(self, name, shape, sampleRate):
+		key = (name, sampleRate)
+		with self._lock:
+			bank = self._banks.get(key)
+			if bank is None:
+				bank = WavetableBank(name, shape, sampleRate)
+				self._banks[key] = bank
+		return bank
+
+_cache = _BankCache()
+
+def getBank(name, shape, sampleRate):
+	return _cache.get(name, shape, sampleRate)
+
+def _render(bandLimited, naive, phase, frequency, out):
+	# Below the audio range aliasing doesn't matter, there the naive waveform is used. LFOs keep exact gates
+	# and ramps instead of the ringing of the lowest octave's table. Both functions take (phase, out).
+	low = np.abs(frequency) < lowestFrequency
+	if not np.any(low):
+		return bandLimited(phase, out)
+	if np.all(low):
+		return naive(phase, out)
+	exact = naive(phase, None) # before bandLimited overwrites the phase
+	out = bandLimited(phase, out)
+	np.copyto(out, exact, where=np.broadcast_to(low, out.shape))
+	return out
+
+def saw(phase, frequency, sampleRate, out=None):
+	bank = getBank("saw", _naiveSaw, sampleRate)
+	return _render(lambda phase, out: bank.render(phase, frequency, out), oscillator.saw, phase, frequency, out)
+
+def pulse(phase, duty, frequency, sampleRate, out=None):
+	# 1 for the first duty fraction of every cycle and -1 for the rest
+	duty = np.clip(duty, 0.0, 1.0)
+	if np.ndim(duty) == 0:
+		step = int(round(float(duty) * dutySteps))
+		bank = getBank("pulse%d" % step, _naivePulse(step / dutySteps), sampleRate)
+		bandLimited = lambda phase, out: bank.render(phase, frequency, out)
+	else:
+		# a table per sample is not feasible, modulated pulses are the difference of two saws shifted by duty
+		sawBank = getBank("saw", _naiveSaw, sampleRate)
+		def bandLimited(phase, out):
+			shifted = sawBank.render(phase - duty, frequency)
+			out = sawBank.render(phase, frequency, out)
+			np.subtract(shifted, out, out=out)
+			out += 2.0 * duty - 1.0
+			return out
+	return _render(bandLimited, lambda phase, out: oscillator.pulse(phase, duty, out), phase, frequency, out)
+
+def triangle(phase, risingTime, frequency, sampleRate, out=None):
+	if np.ndim(risingTime) != 0:
+		# a table per sample is not feasible, modulated shapes use the naive waveform
+		return oscillator.triangle(phase, risingTime, out)
+	step = int(round(float(np.clip(risingTime, 0.0, 1.0)) * risingTimeSteps))
+	bank = getBank("triangle%d" % step, _naiveTriangle(step / risingTimeSteps), sampleRate)
+	return _render(lambda phase, out: bank.render(phase, frequency, out), lambda phase, out: oscillator.triangle(phase, risingTime, out), phase, frequency, out)